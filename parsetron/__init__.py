@@ -7,6 +7,8 @@ __version__ = parsetron.__version__
 __all__ = [
     "strip_string",
     "find_word_boundaries",
+    "set_grammar_cache",
+    "set_lazy_grammars",
     "ParseException",
     "GrammarException",
     "MetaGrammar",
@@ -26,6 +28,7 @@ __all__ = [
     "OneOrMore",
     "ZeroOrMore",
     "NULL",
+    "MultiRegex",
     "GrammarImpl",
     "Production",
     "ExpressionProduction",
@@ -37,6 +40,9 @@ __all__ = [
     "ParseResult",
     "Chart",
     "IncrementalChart",
+    "SparseChart",
+    "SparseIncrementalChart",
+    "ParseForest",
     "ChartRule",
     "TopDownInitRule",
     "BottomUpScanRule",
@@ -50,4 +56,7 @@ __all__ = [
     "BottomUpStrategy",
     "LeftCornerStrategy",
     "RobustParser",
+    "ParseSession",
+    "AsyncParser",
+    "AsyncParseSession",
 ]
@@ -3,13 +3,27 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 import re
+import os
+import io
 import sys
 import itertools
 import json
 import logging
 import copy
+import heapq
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import sre_constants
+import sre_parse
 from collections import deque
 from collections import Counter
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 __doc__ = \
     """
@@ -64,12 +78,60 @@ class GrammarException(Exception):
 # ##### Semantic Grammar ######
 
 
+_lazy_grammars = os.environ.get("PARSETRON_LAZY_GRAMMARS", "") not in \
+    ("", "0")
+# lazily defined grammar classes not compiled yet, in definition order
+_pending_grammars = []
+_compile_lock = threading.RLock()
+
+
+def set_lazy_grammars(lazy):
+    """
+    Turn lazy grammar compilation on or off. The default is off unless the
+    ``PARSETRON_LAZY_GRAMMARS`` environment variable is set (and not "0").
+    Only grammars defined after this call are affected.
+
+    A lazy :class:`Grammar` is compiled into a :class:`GrammarImpl` on its
+    first construction instead of when its class is defined, thus importing
+    many grammars but using a few is cheap.
+
+    :param bool lazy: whether to compile grammars lazily
+    """
+    global _lazy_grammars
+    _lazy_grammars = lazy
+
+
+def _compile_grammar(cls):
+    """
+    Compile the lazily defined grammar class `cls` if not yet. Pending
+    grammars defined before `cls` that share elements with it are compiled
+    first, so that shared elements are named and streamlined the same way
+    as with eager compilation.
+
+    :return: the compiled grammar
+    :rtype: :class:`GrammarImpl`
+    """
+    with _compile_lock:
+        if cls.__dict__['_grammar_'] is None:
+            ids = set(id(e) for e in
+                      GrammarImpl._collect_elements(cls.__dict__['GOAL']))
+            for earlier in _pending_grammars[:_pending_grammars.index(cls)]:
+                if any(id(e) in ids for e in GrammarImpl._collect_elements(
+                        earlier.__dict__['GOAL'])):
+                    _compile_grammar(earlier)
+            cls._grammar_ = GrammarImpl(cls.__name__, dict(cls.__dict__))
+            _pending_grammars.remove(cls)
+        return cls.__dict__['_grammar_']
+
+
 class MetaGrammar(type):
     """
     A meta grammar used to extract symbol names (expressed as variables)
     during grammar *construction* time. This provides a cleaner way than
     using obj.__class__.__dict__, whose __dict__ has to be accessed via
     an extra and explicit function call.
+
+    Grammars are compiled here unless lazy (see :func:`set_lazy_grammars`).
     """
 
     def __new__(typ, name, bases, dct):
@@ -83,6 +145,12 @@ class MetaGrammar(type):
                 raise GrammarException("_grammar_ is reserved.")
             if "GOAL" not in dct:
                 raise GrammarException("you must define your GOAL in grammar")
+            elif _lazy_grammars:
+                dct["_grammar_"] = None
+                cls = super(MetaGrammar, typ).__new__(typ, name, bases, dct)
+                with _compile_lock:
+                    _pending_grammars.append(cls)
+                return cls
             else:
                 dct["_grammar_"] = GrammarImpl(name, dct)
         return super(MetaGrammar, typ).__new__(typ, name, bases, dct)
@@ -114,7 +182,10 @@ class Grammar(object):
     __metaclass__ = MetaGrammar
 
     def __new__(cls):
-        return cls.__dict__['_grammar_']
+        grammar = cls.__dict__['_grammar_']
+        if grammar is None:
+            grammar = _compile_grammar(cls)
+        return grammar
 
     @staticmethod
     def test():
@@ -392,10 +463,25 @@ class GrammarElement(object):
         """
         if not self.streamlined:
             self.streamline()
+        return self._parse(instring)
+
+    def match(self, instring):
+        """
+        Non-raising version of :func:`parse` for hot loops in the parser:
+        return True if the whole string is parsed else False, without
+        raising :class:`ParseException`. Built-in terminals implement it
+        without exceptions at all.
+
+        .. warning:: subclasses overriding :func:`_parse` of a terminal
+            that implements this function should override it too.
+
+        :param str instring: input string
+        :return bool: True if the whole string is parsed else False
+        """
         try:
-            return self._parse(instring)
-        except ParseException as e:
-            raise e
+            return bool(self.parse(instring))
+        except ParseException:
+            return False
 
     def streamline(self):
         self.streamlined = True
@@ -423,6 +509,52 @@ class GrammarElement(object):
         """
         return Production.factory(self)
 
+    def get_lexicon(self):
+        """
+        Return all strings this terminal parses if they can be enumerated.
+        This is used by :class:`GrammarImpl` to index terminals by lexicon.
+        Elements whose strings can't be enumerated (e.g., :class:`RegexCs`)
+        return None and are parsed one by one instead.
+
+        .. warning:: subclasses overriding :func:`_parse` of a terminal
+            that implements this function should override it too.
+
+        :return: a tuple of (iterable of strings, caseless) or None
+        """
+        return None
+
+    def get_regex(self):
+        """
+        Return the compiled regular expression deciding (through
+        :func:`re.match`) whether this terminal parses a string, or None if
+        this terminal doesn't parse with a regular expression. This is used
+        by :class:`MultiRegex` to match all regex terminals at once.
+
+        .. warning:: subclasses overriding :func:`_parse` of a terminal
+            that implements this function should override it too.
+
+        :return: a compiled regular expression or None
+        """
+        return None
+
+    def max_tokens(self):
+        """
+        Return the maximal number of space-separated tokens in a phrase this
+        terminal parses, or None if unknown. The parser never tries phrases
+        longer than any terminal can parse (see
+        :attr:`GrammarImpl.max_phrase_tokens`). By default it is known when
+        strings can be enumerated (:func:`get_lexicon`).
+
+        .. warning:: subclasses overriding :func:`_parse` of a terminal
+            that implements this function should override it too.
+
+        :return: int or None
+        """
+        lexicon = self.get_lexicon()
+        if lexicon is None:
+            return None
+        return max([s.count(" ") + 1 for s in lexicon[0]] or [0])
+
     def run_post_funcs(self, result):
         """
         Run functions set by :func:`set_result_action` after getting parsing
@@ -455,6 +587,12 @@ class StringCs(GrammarElement):
         else:
             raise ParseException
 
+    def match(self, instring):
+        return self.pattern == instring
+
+    def get_lexicon(self):
+        return [self.pattern], False
+
     def default_name(self):
         return self.str
 
@@ -469,6 +607,12 @@ class String(StringCs):
     def _parse(self, instring):
         return super(String, self)._parse(instring.lower())
 
+    def match(self, instring):
+        return self.pattern == instring.lower()
+
+    def get_lexicon(self):
+        return [self.pattern], True
+
 
 class SetCs(GrammarElement):
     """
@@ -523,6 +667,14 @@ class SetCs(GrammarElement):
         else:
             raise ParseException
 
+    def match(self, instring):
+        if self.caseless:
+            instring = instring.lower()
+        return instring in self._set
+
+    def get_lexicon(self):
+        return self._set, self.caseless
+
     def default_name(self):
         return self.str
 
@@ -588,6 +740,91 @@ class RegexCs(GrammarElement):
             # else:
             return True
 
+    def match(self, instring):
+        return self.re.match(instring) is not None
+
+    def get_regex(self):
+        return self.re
+
+    # character categories that never match a space
+    _SPACELESS_CATEGORIES = frozenset([
+        sre_constants.CATEGORY_DIGIT, sre_constants.CATEGORY_NOT_SPACE,
+        sre_constants.CATEGORY_WORD, sre_constants.CATEGORY_LINEBREAK,
+        sre_constants.CATEGORY_LOC_WORD, sre_constants.CATEGORY_UNI_DIGIT,
+        sre_constants.CATEGORY_UNI_NOT_SPACE, sre_constants.CATEGORY_UNI_WORD,
+        sre_constants.CATEGORY_UNI_LINEBREAK])
+
+    def max_tokens(self):
+        """
+        Return the maximal number of spaces the pattern matches plus one if
+        the pattern has to match a whole phrase (ending with ``$``) and
+        doesn't repeat spaces unboundedly (e.g., ``r"(turn on|off)"``),
+        otherwise None.
+        """
+        try:
+            parsed = sre_parse.parse(self.re.pattern, self.re.flags)
+        except (sre_constants.error, TypeError):
+            return None
+        items = list(parsed)
+        if len(items) == 0 or items[-1] not in (
+                (sre_constants.AT, sre_constants.AT_END),
+                (sre_constants.AT, sre_constants.AT_END_STRING)):
+            return None
+        spaces = self._max_spaces(items)
+        return None if spaces is None else spaces + 1
+
+    @classmethod
+    def _max_spaces(cls, items):
+        """
+        Conservatively count the maximal number of spaces parsed regex
+        `items` match, or None if unbounded.
+        """
+        spaces = 0
+        for op, av in items:
+            if op == sre_constants.LITERAL:
+                spaces += av == 32
+            elif op == sre_constants.NOT_LITERAL:
+                spaces += av != 32
+            elif op == sre_constants.ANY:
+                spaces += 1
+            elif op == sre_constants.IN:
+                negate, covered = False, False
+                for in_op, in_av in av:
+                    if in_op == sre_constants.NEGATE:
+                        negate = True
+                    elif in_op == sre_constants.LITERAL:
+                        covered |= in_av == 32
+                    elif in_op == sre_constants.RANGE:
+                        covered |= in_av[0] <= 32 <= in_av[1]
+                    elif in_op == sre_constants.CATEGORY:
+                        covered |= in_av not in cls._SPACELESS_CATEGORIES
+                    else:
+                        covered = not negate
+                spaces += covered != negate
+            elif op == sre_constants.BRANCH:
+                branches = [cls._max_spaces(b) for b in av[1]]
+                if None in branches:
+                    return None
+                spaces += max(branches)
+            elif op == sre_constants.SUBPATTERN:
+                sub = cls._max_spaces(av[-1])
+                if sub is None:
+                    return None
+                spaces += sub
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                sub = cls._max_spaces(av[-1])
+                if sub is None or \
+                        (sub > 0 and av[1] == sre_constants.MAXREPEAT):
+                    return None
+                spaces += sub * av[1]
+            elif op in (sre_constants.AT, sre_constants.ASSERT,
+                        sre_constants.ASSERT_NOT):
+                # zero-width
+                continue
+            else:
+                return None
+        return spaces
+
     def default_name(self):
         return self.str
 
@@ -834,6 +1071,12 @@ class Null(GrammarElement):
         """
         return False
 
+    def match(self, instring):
+        return False
+
+    def max_tokens(self):
+        return 0
+
     def default_name(self):
         return "Null"
 
@@ -848,10 +1091,118 @@ NULL = Null().set_name("NULL")
 
 # ##### Real Grammar Implementation ######
 
+class MultiRegex(object):
+    r"""
+    Match a phrase against many regex terminals (see
+    :func:`GrammarElement.get_regex`) in one pass. Each pattern is wrapped
+    in an optional named look-ahead group and all of them are joined into
+    one combined pattern::
+
+        (?:(?=(?P<_0>^\d+$)))?(?:(?=(?P<_1>^(on|off)$)))?...
+
+    A single :func:`re.match` with the combined pattern then tells which
+    terminals parse the phrase: exactly those whose group took part in the
+    match. Patterns are combined per :mod:`re` flags (e.g., :class:`Regex`
+    is caseless while :class:`RegexCs` is not). Patterns that can't be
+    safely combined (named groups, backreferences, conditional groups,
+    global inline flags or verbose mode) are parsed one by one.
+
+    :param list productions: terminal productions with regex terminals
+    """
+    # Python 2 re supports at most 100 groups in a pattern
+    MAX_GROUPS = 99
+    _UNSAFE = re.compile(r"\(\?P=|\\[1-9]|\(\?\(|\(\?[iLmsux]+\)")
+
+    def __init__(self, productions):
+        # a list of (combined regex, [(group index, production)])
+        self.regexes = []
+        # productions parsed one by one
+        self.fallback = []
+        flags2prods = {}
+        for prod in productions:
+            regex = prod.lhs.get_regex()
+            if self._is_combinable(regex):
+                flags2prods.setdefault(regex.flags, []).append(prod)
+            else:
+                self.fallback.append(prod)
+
+        for flags, prods in flags2prods.items():
+            parts, names, num_groups = [], [], 0
+            for prod in prods:
+                regex = prod.lhs.get_regex()
+                if num_groups + regex.groups + 1 > self.MAX_GROUPS:
+                    self._add_combined(parts, names, flags)
+                    parts, names, num_groups = [], [], 0
+                name = "_%d" % len(names)
+                parts.append("(?:(?=(?P<%s>%s)))?" % (name, regex.pattern))
+                names.append((name, prod))
+                num_groups += regex.groups + 1
+            self._add_combined(parts, names, flags)
+
+    def _is_combinable(self, regex):
+        return (regex.groups + 1 <= self.MAX_GROUPS and
+                not regex.groupindex and
+                not regex.flags & re.VERBOSE and
+                not self._UNSAFE.search(regex.pattern))
+
+    def _add_combined(self, parts, names, flags):
+        if len(parts) == 0:
+            return
+        combined = re.compile("".join(parts), flags)
+        self.regexes.append(
+            (combined, [(combined.groupindex[name], prod)
+                        for name, prod in names]))
+
+    def match(self, lexicon):
+        """
+        Yield all productions whose regex terminal parses `lexicon`.
+
+        :param str lexicon: a string to be parsed
+        :return: a production generator
+        :rtype: generator(:class:`Production`)
+        """
+        for combined, groups in self.regexes:
+            # every part of the combined pattern is optional, so it always
+            # matches; participating groups have a start position >= 0
+            m = combined.match(lexicon)
+            for i, prod in groups:
+                if m.start(i) >= 0:
+                    yield prod
+        for prod in self.fallback:
+            if prod.lhs.match(lexicon):
+                yield prod
+
+
+# ##### Grammar Cache ######
+
+# bump whenever the layout of a compiled grammar changes
+GRAMMAR_CACHE_FORMAT = 1
+_grammar_cache_dir = os.environ.get("PARSETRON_GRAMMAR_CACHE") or None
+
+
+def set_grammar_cache(directory):
+    """
+    Set the directory where compiled grammars are cached, or None to turn
+    the cache off. The default is the ``PARSETRON_GRAMMAR_CACHE``
+    environment variable, or off if unset. Only grammars defined after this
+    call are affected.
+
+    A :class:`GrammarImpl` is then loaded from its cache file instead of
+    being compiled. Cache files are named after the grammar and a
+    fingerprint of its elements, thus changing a grammar (or the parsetron
+    version) invalidates its cache.
+
+    :param str directory: an existing, writable directory, or None
+    """
+    global _grammar_cache_dir
+    _grammar_cache_dir = directory
+
+
 class GrammarImpl(object):
     """
     Actual grammar implementation that is returned by a :class:`Grammar`
-    construction.
+    construction. See :func:`set_grammar_cache` to cache compiled grammars
+    on disk.
     """
 
     def __init__(self, name, dct):
@@ -865,7 +1216,31 @@ class GrammarImpl(object):
         self.name = name
         self._vid2name = self._extract_var_names(dct)
         self.goal = dct['GOAL']
+        self.logger = logging.getLogger(__name__)
+
+        cache_dir = _grammar_cache_dir
+        path = None
+        if cache_dir is not None:
+            elements = self._collect_elements(self.goal)
+            try:
+                path = os.path.join(cache_dir, "%s-%s.grammar" % (
+                    self.name, self._fingerprint(elements)))
+            except TypeError as e:
+                self.logger.warning("can't cache grammar %s: %s",
+                                    self.name, e)
+        if path is None:
+            self._compile()
+        elif not self._load_cache(path, elements):
+            self._compile()
+            # so that parsers don't need to build them after loading
+            self.build_leftcorner_table()
+            self._save_cache(path, elements)
+
+        if not self.logger.disabled:
+            self.logger.debug("Grammar size: %d" % len(self))
+            self.logger.debug("Grammar:\n" + str(self) + "\n")
 
+    def _compile(self):
         # call _set_element_name_recursively() first then
         # _build_grammar_recursively(), the latter decides whether to
         # streamline expressions based on element names
@@ -876,6 +1251,8 @@ class GrammarImpl(object):
         self.nonterminal2prod = {}
         self.terminal2prod[NULL] = NullProduction
         self.productions.add(NullProduction)
+        for prod in self.productions:
+            prod.validate()
         self.goal_productions = set()
         for prod in self.productions:
             if prod.is_terminal:
@@ -887,13 +1264,189 @@ class GrammarImpl(object):
                 self.nonterminal2prod[prod.lhs].add(prod)
             if prod.lhs == self.goal:
                 self.goal_productions.add(prod)
-        self._lc_words = {}  # for terminal
-        self._lc_cats = {}   # for non-terminal
+        self._build_lexicon_index()
+        self._build_prediction_index()
+        self.max_phrase_tokens = self._max_phrase_tokens()
+        self._number_productions()
+        # left-corner bitsets over production ids, indexed by production id
+        self._lc_words = []    # for terminal
+        self._lc_cats = []     # for non-terminal
+        self._lc_parents = []  # terminal -> productions having it as LC
 
-        self.logger = logging.getLogger(__name__)
-        if not self.logger.disabled:
-            self.logger.debug("Grammar size: %d" % len(self))
-            self.logger.debug("Grammar:\n" + str(self) + "\n")
+    @staticmethod
+    def _collect_elements(goal):
+        """
+        Return all grammar elements reachable from `goal` in a fixed depth
+        first order.
+        """
+        elements, seen = [], set()
+        stack = [goal]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, GrammarElement):
+                if id(value) in seen:
+                    continue
+                seen.add(id(value))
+                elements.append(value)
+                children = [v for _, v in sorted(value.__dict__.items())]
+            elif isinstance(value, (list, tuple)):
+                children = value
+            else:
+                continue
+            stack.extend(reversed(children))
+        return elements
+
+    @staticmethod
+    def _collect_actions(elements):
+        """
+        Return the functions (e.g., result actions) held by `elements`, in a
+        fixed order. They are kept as references in the grammar cache, as
+        lambdas and closures can't be pickled.
+        """
+        actions, seen = [], set()
+        for e in elements:
+            for _, value in sorted(e.__dict__.items()):
+                values = value if isinstance(value, (list, tuple)) \
+                    else [value]
+                for v in values:
+                    if callable(v) and id(v) not in seen and \
+                            not isinstance(v, (GrammarElement, type)):
+                        seen.add(id(v))
+                        actions.append(v)
+        return actions
+
+    def _fingerprint(self, elements):
+        """
+        Return a hex digest of the structure and the fields of `elements`
+        (see :func:`_collect_elements`), used to key the grammar cache.
+        Fields derived from others (e.g., ``str``) are left out, so that
+        the digest doesn't depend on the order of sets.
+
+        :raise TypeError: if a field can't be described stably
+        """
+        index = dict((id(e), i) for i, e in enumerate(elements))
+
+        scalars = (type(""), type(b""), int, float, type(None))
+
+        def describe(value):
+            if isinstance(value, scalars):
+                return repr(value)
+            if isinstance(value, GrammarElement) and id(value) in index:
+                return "#%d" % index[id(value)]
+            if isinstance(value, (list, tuple)):
+                return "[%s]" % ", ".join(describe(v) for v in value)
+            if isinstance(value, (set, frozenset)):
+                return "{%s}" % ", ".join(sorted(describe(v) for v in value))
+            if isinstance(value, dict):
+                return "{%s}" % ", ".join(sorted(
+                    "%s: %s" % (describe(k), describe(v))
+                    for k, v in value.items()))
+            if hasattr(value, "pattern") and hasattr(value, "flags"):
+                return "re(%r, %d)" % (value.pattern, value.flags)
+            if callable(value) and hasattr(value, "__name__"):
+                return "%s.%s" % (getattr(value, "__module__", None),
+                                  value.__name__)
+            raise TypeError("can't fingerprint %s" %
+                            value.__class__.__name__)
+
+        lines = ["%s %s %d %r" % (self.name, __version__,
+                                  GRAMMAR_CACHE_FORMAT, sys.version_info[:2])]
+        for e in elements:
+            lines.append("%s.%s %s %s" % (
+                e.__class__.__module__, e.__class__.__name__,
+                self._get_variable_name(e),
+                describe(sorted((k, v) for k, v in e.__dict__.items()
+                                if k not in ("str", "canonical_name")))))
+        return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+
+    def _save_cache(self, path, elements):
+        """
+        Atomically write the compiled grammar to `path`: the fields of all
+        `elements` (compiling names and streamlines them) and of this
+        grammar. Elements and their actions are written as references into
+        `elements`, thus a loaded grammar shares them with its
+        :class:`Grammar` class. Failures are logged and ignored.
+        """
+        index = dict((id(e), i) for i, e in enumerate(elements))
+        actions = self._collect_actions(elements)
+        action_index = dict((id(f), i) for i, f in enumerate(actions))
+
+        def persistent_id(obj):
+            if id(obj) in index and obj is elements[index[id(obj)]]:
+                return "e%d" % index[id(obj)]
+            elif id(obj) in action_index and \
+                    obj is actions[action_index[id(obj)]]:
+                return "f%d" % action_index[id(obj)]
+            elif obj is NULL:
+                return "null"
+            elif obj is NullProduction:
+                return "null_production"
+            return None
+
+        state = dict((k, v) for k, v in self.__dict__.items()
+                     if k not in ("name", "goal", "logger", "_vid2name"))
+        tmp = None
+        try:
+            buf = io.BytesIO()
+            pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistent_id
+            pickler.dump(([e.__dict__ for e in elements], state))
+            payload = buf.getvalue()
+            header = "parsetron-grammar %d %s\n" % (
+                GRAMMAR_CACHE_FORMAT, hashlib.sha1(payload).hexdigest())
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(header.encode("ascii"))
+                f.write(payload)
+            os.rename(tmp, path)
+        except Exception as e:
+            self.logger.warning("can't cache grammar %s to %s: %s",
+                                self.name, path, e)
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _load_cache(self, path, elements):
+        """
+        Load the compiled grammar written by :func:`_save_cache`.
+
+        :return bool: False if `path` is missing or corrupt
+        """
+        try:
+            with open(path, "rb") as f:
+                header = f.readline().decode("ascii").split()
+                payload = f.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            return False
+        if header != ["parsetron-grammar", str(GRAMMAR_CACHE_FORMAT),
+                      hashlib.sha1(payload).hexdigest()]:
+            self.logger.warning("ignoring corrupt grammar cache %s", path)
+            return False
+
+        actions = self._collect_actions(elements)
+
+        def persistent_load(pid):
+            if pid == "null":
+                return NULL
+            elif pid == "null_production":
+                return NullProduction
+            elif pid.startswith("f"):
+                return actions[int(pid[1:])]
+            return elements[int(pid[1:])]
+
+        try:
+            unpickler = pickle.Unpickler(io.BytesIO(payload))
+            unpickler.persistent_load = persistent_load
+            element_states, state = unpickler.load()
+        except Exception as e:
+            self.logger.warning("can't load grammar cache %s: %s", path, e)
+            return False
+        if len(element_states) != len(elements):
+            return False
+        for element, element_state in zip(elements, element_states):
+            element.__dict__.update(element_state)
+        self.__dict__.update(state)
+        return True
 
     def _eliminate_null_and_expand(self):
         """
@@ -1008,6 +1561,125 @@ class GrammarImpl(object):
         # if redo:
         #     self._eliminate_null_and_expand()
 
+    def _build_lexicon_index(self):
+        """
+        Index terminal productions by the exact strings they parse, so that
+        :func:`filter_terminals_for_scan` finds them with a dictionary lookup
+        instead of parsing with every terminal. Regex terminals whose strings
+        can't be enumerated (see :func:`GrammarElement.get_lexicon`) are
+        matched together by a :class:`MultiRegex`, and any other terminals
+        are kept in a list and parsed one by one.
+
+        The same strings are also put into :attr:`phrase_trie`, a token
+        level prefix trie telling the parser which phrases are worth
+        scanning or extending (see :func:`phrase_may_parse` and
+        :func:`phrase_may_grow`).
+        """
+        # string -> list of terminal productions
+        self._lexicon_cs = {}
+        # lower-cased string -> list of terminal productions
+        self._lexicon_ci = {}
+        self._unindexed_terminals = []
+        # lower-cased token -> sub-trie, None -> True at the end of a string
+        self.phrase_trie = {}
+        # maximal tokens of phrases parsed by terminals not in phrase_trie
+        self._unlexicon_max_tokens = 0
+        regex_prods = []
+        for prod in self.productions:
+            if not prod.is_terminal:
+                continue
+            lexicon = prod.lhs.get_lexicon()
+            if lexicon is None:
+                if prod.lhs.get_regex() is not None:
+                    regex_prods.append(prod)
+                else:
+                    self._unindexed_terminals.append(prod)
+                if self._unlexicon_max_tokens is not None:
+                    max_tokens = prod.lhs.max_tokens()
+                    self._unlexicon_max_tokens = None if max_tokens is None \
+                        else max(self._unlexicon_max_tokens, max_tokens)
+                continue
+            strings, caseless = lexicon
+            if caseless:
+                for string in strings:
+                    self._lexicon_ci.setdefault(string.lower(), []).append(
+                        prod)
+            else:
+                for string in strings:
+                    self._lexicon_cs.setdefault(string, []).append(prod)
+            for string in strings:
+                node = self.phrase_trie
+                for token in string.lower().split(" "):
+                    node = node.setdefault(token, {})
+                node[None] = True
+        self._regex_matcher = MultiRegex(regex_prods)
+
+    def advance_phrase(self, node, token):
+        """
+        Walk :attr:`phrase_trie` from `node`, the node of a phrase, to the
+        node of the phrase extended by `token`.
+
+        :param dict node: a node of :attr:`phrase_trie`, or None
+        :param str token: the next token of the phrase
+        :return: the node of the extended phrase, or None if no enumerable
+            string starts with the extended phrase
+        """
+        for word in token.lower().split(" "):
+            if node is None:
+                break
+            node = node.get(word)
+        return node
+
+    def phrase_may_parse(self, node, num_tokens):
+        """
+        Tell whether some terminal may parse a phrase of `num_tokens` tokens
+        whose :attr:`phrase_trie` node is `node`. False means no terminal
+        does.
+        """
+        return (node is not None and None in node) or \
+            self._unlexicon_max_tokens is None or \
+            num_tokens <= self._unlexicon_max_tokens
+
+    def phrase_may_grow(self, node, num_tokens):
+        """
+        Tell whether some terminal may parse a longer phrase starting with a
+        phrase of `num_tokens` tokens whose :attr:`phrase_trie` node is
+        `node`. False means the phrase is dead.
+        """
+        return (node is not None and len(node) > (None in node)) or \
+            self._unlexicon_max_tokens is None or \
+            num_tokens < self._unlexicon_max_tokens
+
+    def _max_phrase_tokens(self):
+        """
+        Return the maximal number of tokens in a phrase any terminal parses,
+        or None if some terminal doesn't tell (see
+        :func:`GrammarElement.max_tokens`).
+        """
+        max_tokens = 0
+        for prod in self.terminal2prod.values():
+            n = prod.lhs.max_tokens()
+            if n is None:
+                return None
+            max_tokens = max(max_tokens, n)
+        return max_tokens
+
+    def _build_prediction_index(self):
+        """
+        Index productions by their LHS and by their first RHS element for
+        :func:`filter_productions_for_prediction_by_lhs` and
+        :func:`filter_productions_for_prediction_by_rhs`. Grammar elements
+        hash by id, thus a lookup is as strict as comparing with "is".
+        """
+        lhs2prods, rhs2prods = {}, {}
+        for prod in self.productions:
+            lhs2prods.setdefault(prod.lhs, []).append(prod)
+            rhs2prods.setdefault(prod.rhs[0], []).append(prod)
+        self._lhs2prods = dict((lhs, tuple(prods))
+                               for lhs, prods in lhs2prods.items())
+        self._rhs2prods = dict((rhs, tuple(prods))
+                               for rhs, prods in rhs2prods.items())
+
     def _get_variable_name(self, variable):
         return self._vid2name.get(id(variable), None)
 
@@ -1122,29 +1794,195 @@ class GrammarImpl(object):
             "(" + expr_name + ")"
         element.name_is_set = True
 
+    def _number_productions(self):
+        """
+        Number productions densely into :attr:`Production.id`
+        (:data:`NullProduction` is always 0). Edges are keyed by these ids,
+        and sets of productions are stored as integer bitsets of them.
+        """
+        self._id2prod = [NullProduction] + \
+            [p for p in self.productions if p is not NullProduction]
+        for i, prod in enumerate(self._id2prod):
+            prod.id = i
+
+    def _prod_id(self, prod):
+        """
+        Return the id of `prod` if it is a production of this grammar,
+        else None.
+        """
+        i = prod.id
+        if 0 <= i < len(self._id2prod) and self._id2prod[i] is prod:
+            return i
+        return None
+
+    def productions_of(self, mask):
+        """
+        Return the productions in bitset `mask`, ordered by id.
+
+        :param int mask: a bitset of production ids
+        :rtype: list(:class:`Production`)
+        """
+        id2prod = self._id2prod
+        prods = []
+        while mask:
+            low = mask & -mask
+            prods.append(id2prod[low.bit_length() - 1])
+            mask ^= low
+        return prods
+
+    def production_mask(self, prods):
+        """
+        Return the bitset of productions `prods`.
+
+        :param prods: an iterable of :class:`Production`
+        :rtype: int
+        """
+        mask = 0
+        for prod in prods:
+            mask |= 1 << prod.id
+        return mask
+
+    def scan_terminal_mask(self, lexicon):
+        """
+        Return the bitset of :func:`filter_terminals_for_scan`.
+
+        :param str lexicon: a string to be parsed
+        :rtype: int
+        """
+        return self.production_mask(self.filter_terminals_for_scan(lexicon))
+
     def build_leftcorner_table(self):
         """
-        For each grammar production, build two mappings from the production
-        to:
+        For each grammar production, build two bitsets of productions:
 
             1. its left corner RHS element (which is a pre-terminal);
             2. the terminal element that does the actual parsing job.
-        """
-        def add_to_leftcorner(prod, c_prod):
-            rhs = c_prod.rhs[0]
-            if prod not in self._lc_words:
-                self._lc_words[prod] = set()
-                self._lc_cats[prod] = {prod}
 
+        The first is the reflexive transitive closure of the "RHS[0]
+        derives" relation, the second collects the terminals directly
+        derived by productions in the first. A reverse bitset for each
+        terminal tells which productions have it as a left corner.
+
+        The tables are only built once.
+        """
+        if self._lc_cats:
+            return
+        num = len(self._id2prod)
+        # "RHS[0] derives" relation and its inverse, as production ids
+        children = [[] for _ in xrange(num)]
+        parents = [[] for _ in xrange(num)]
+        direct_words = []
+        for i, prod in enumerate(self._id2prod):
+            rhs = prod.rhs[0]
+            words = 0
             if rhs.is_terminal:
-                self._lc_words[prod].add(self.terminal2prod[rhs])
+                words = 1 << self.terminal2prod[rhs].id
             else:
-                for cc_prod in self.nonterminal2prod[rhs]:
-                    self._lc_cats[prod].add(cc_prod)
-                    add_to_leftcorner(prod, cc_prod)
+                for c_prod in self.nonterminal2prod.get(rhs, ()):
+                    children[i].append(c_prod.id)
+                    parents[c_prod.id].append(i)
+            direct_words.append(words)
+
+        own = [1 << i for i in xrange(num)]
+        lc_cats = self._close_bitsets(children, own)
+        lc_words = self._close_bitsets(children, direct_words)
+        # productions having i in their left corner closure
+        ancestors = self._close_bitsets(parents, own)
+        lc_parents = [0] * num
+        for i, words in enumerate(direct_words):
+            if words:
+                lc_parents[words.bit_length() - 1] |= ancestors[i]
+        self._lc_cats = lc_cats
+        self._lc_words = lc_words
+        self._lc_parents = lc_parents
 
-        for prod in self.productions:
-            add_to_leftcorner(prod, prod)
+    @staticmethod
+    def _close_bitsets(successors, bits):
+        """
+        Return for each node of a graph the union of `bits` over all the
+        nodes reachable from it, itself included. Strongly connected
+        components are found (Tarjan) and closed in reverse topological
+        order, thus each edge is followed once.
+
+        :param list successors: successor node ids of each node id
+        :param list bits: bitset (int) of each node id
+        :rtype: list
+        """
+        num = len(successors)
+        index = [None] * num
+        low = [0] * num
+        component = [None] * num
+        closed = list(bits)
+        stack, counter = [], 0
+        for root in xrange(num):
+            if index[root] is not None:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            work = [(root, iter(successors[root]))]
+            while work:
+                v, succ = work[-1]
+                for w in succ:
+                    if index[w] is None:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        work.append((w, iter(successors[w])))
+                        break
+                    elif component[w] is None:
+                        # on the stack: same component as v
+                        low[v] = min(low[v], index[w])
+                else:
+                    work.pop()
+                    if work:
+                        u = work[-1][0]
+                        low[u] = min(low[u], low[v])
+                    if low[v] == index[v]:
+                        members = []
+                        while True:
+                            w = stack.pop()
+                            component[w] = v
+                            members.append(w)
+                            if w == v:
+                                break
+                        # other successors are in closed components
+                        union = 0
+                        for w in members:
+                            union |= bits[w]
+                            for x in successors[w]:
+                                if component[x] != v:
+                                    union |= closed[x]
+                        for w in members:
+                            closed[w] = union
+        return closed
+
+    def get_left_corner_terminal_mask(self, prod):
+        """
+        Bitset version of :func:`get_left_corner_terminals`.
+
+        :param Production prod: a grammar production
+        :rtype: int
+        """
+        i = self._prod_id(prod)
+        if i is None or i >= len(self._lc_words):
+            return 0
+        return self._lc_words[i]
+
+    def get_left_corner_predictions(self, prod, term):
+        """
+        Return the left-corner non-terminal productions of `prod` (see
+        :func:`get_left_corner_nonterminals`) that have the terminal
+        production `term` as a left-corner terminal.
+
+        :param Production prod: a grammar production
+        :param Production term: a terminal production
+        :rtype: list(:class:`Production`)
+        """
+        i, t = self._prod_id(prod), self._prod_id(term)
+        if i is None or t is None or i >= len(self._lc_cats):
+            return []
+        return self.productions_of(self._lc_cats[i] & self._lc_parents[t])
 
     def get_left_corner_terminals(self, prod):
         """
@@ -1163,7 +2001,8 @@ class GrammarImpl(object):
         :param Production prod: a grammar production
         :return: set(:class:`Production`)
         """
-        return self._lc_words.get(prod, set())
+        return set(self.productions_of(
+            self.get_left_corner_terminal_mask(prod)))
 
     def get_left_corner_nonterminals(self, prod):
         """
@@ -1184,7 +2023,10 @@ class GrammarImpl(object):
         :param Production prod: a grammar production
         :return: set(:class:`Production`)
         """
-        return self._lc_cats.get(prod, {prod})
+        i = self._prod_id(prod)
+        if i is None or i >= len(self._lc_cats):
+            return {prod}
+        return set(self.productions_of(self._lc_cats[i]))
 
     def __str__(self):
         strings = []
@@ -1201,51 +2043,47 @@ class GrammarImpl(object):
     def __len__(self):
         return len(self.productions)
 
-    # @memoize --> needs to change code to return list intead of a generator
     def filter_terminals_for_scan(self, lexicon):
         """
-        Yield all terminal productions that parses `lexicon`.
+        Yield all terminal productions that parses `lexicon`. Terminals with
+        enumerable strings (:class:`StringCs`, :class:`SetCs` and their
+        caseless versions) are looked up in the lexicon index, regex
+        terminals are matched together by one :class:`MultiRegex` and only
+        the rest are parsed one by one.
 
         :param str lexicon: a string to be parsed
         :return: a production generator
         :rtype: generator(:class:`Production`)
         """
-        for prod in self.productions:
-            if prod.is_terminal:
-                try:
-                    progress = prod.lhs.parse(lexicon)
-                except ParseException:
-                    pass
-                else:
-                    if progress:
-                        yield prod
+        for prod in self._lexicon_cs.get(lexicon, ()):
+            yield prod
+        for prod in self._lexicon_ci.get(lexicon.lower(), ()):
+            yield prod
+        for prod in self._regex_matcher.match(lexicon):
+            yield prod
+        for prod in self._unindexed_terminals:
+            if prod.lhs.match(lexicon):
+                yield prod
 
-    # @memoize --> needs to change code to return list intead of a generator
     def filter_productions_for_prediction_by_rhs(self, rhs_starts_with):
         """
-        Yield all productions whose RHS[0] is `rhs_starts_with`.
+        Return all productions whose RHS[0] is `rhs_starts_with`.
 
         :param GrammarElement rhs_starts_with: a grammar element
-        :return: a production generator
-        :rtype: generator(:class:`Production`)
+        :return: a tuple of productions
+        :rtype: tuple(:class:`Production`)
         """
-        for prod in self.productions:
-            # replaced "==" here with "is" and got 2x speed up
-            if prod.rhs[0] is rhs_starts_with:
-                yield prod
+        return self._rhs2prods.get(rhs_starts_with, ())
 
     def filter_productions_for_prediction_by_lhs(self, lhs):
         """
-        Yield all productions whose LHS is `lhs`.
+        Return all productions whose LHS is `lhs`.
 
         :param GrammarElement lhs: a grammar element
-        :return: a production generator
-        :rtype: generator(:class:`Production`)
+        :return: a tuple of productions
+        :rtype: tuple(:class:`Production`)
         """
-        for prod in self.productions:
-            # replaced "==" here with "is" and got 2x speed up
-            if prod.lhs is lhs:
-                yield prod
+        return self._lhs2prods.get(lhs, ())
 
     # def filter_nonterminals_for_prediction(self):
     #     """ Yield all nonterminal productions.
@@ -1270,14 +2108,17 @@ class Production(object):
     :param list rhs: a list of RHS element, each of which is of
                      :class:`GrammarElement`
     """
+    # provisional ids of productions not compiled into a grammar yet are
+    # negative, so they never collide with the ids given by GrammarImpl
+    _provisional_ids = itertools.count(1)
 
     def __init__(self, lhs, rhs):
-        assert isinstance(lhs, GrammarElement)
-        assert type(rhs) is list, "Error: RHS must be a list"
         self.lhs = lhs
         self.rhs = rhs
         self.rhs_len = len(self.rhs)
         self.is_terminal = lhs.is_terminal
+        # small integer id, unique within a compiled grammar
+        self.id = -next(Production._provisional_ids)
         self._hash = hash((self.lhs,) + tuple(self.rhs))
         # recursive production like the following from
         # ZeroOrMore or OneOrMore:
@@ -1313,16 +2154,35 @@ class Production(object):
     def get_rhs(self, position):
         return self.rhs[position]
 
+    def validate(self):
+        """
+        Check the types of LHS and RHS. Called once per production when a
+        grammar is compiled, instead of on every construction.
+
+        :raise GrammarException: if the production is malformed
+        """
+        if not isinstance(self.lhs, GrammarElement):
+            raise GrammarException("LHS must be a GrammarElement: %r" %
+                                   (self.lhs,))
+        if type(self.rhs) is not list:
+            raise GrammarException("RHS must be a list: %r" % (self.rhs,))
+        for r in self.rhs:
+            if not isinstance(r, GrammarElement):
+                raise GrammarException("RHS must be GrammarElements: %r" %
+                                       (r,))
+
     def __str__(self):
         return "%s (%s) -> [%s]" % \
                (self.lhs.__class__.__name__, _ustr(self.lhs),
                 ", ".join([_ustr(r) for r in self.rhs]))
 
     def __eq__(self, other):
-        # return (self is other or
-        #         (other is not None and self.lhs == other.lhs and
-        #          self.rhs == other.rhs))
-        return hash(self) == hash(other)
+        # grammar elements are compared by identity, as they hash
+        return (self is other or
+                (isinstance(other, Production) and
+                 self._hash == other._hash and self.lhs is other.lhs and
+                 self.rhs_len == other.rhs_len and
+                 all(a is b for a, b in zip(self.rhs, other.rhs))))
 
     def __ne__(self, other):
         return not self == other
@@ -1330,6 +2190,11 @@ class Production(object):
     def __hash__(self):
         return self._hash
 
+    def __setstate__(self, state):
+        # grammar elements hash by id, which changes after unpickling
+        self.__dict__.update(state)
+        self._hash = hash((self.lhs,) + tuple(self.rhs))
+
 
 class ExpressionProduction(Production):
     """
@@ -1368,10 +2233,17 @@ class ElementEnhanceProduction(ElementProduction):
                 Production.__init__(self, element, [rhs])
         else:
             Production.__init__(self, element, [element.expr])
-        assert isinstance(element, GrammarElementEnhance)
+
+    def validate(self):
+        if not isinstance(self.lhs, GrammarElementEnhance):
+            raise GrammarException("LHS must be a GrammarElementEnhance: %r"
+                                   % (self.lhs,))
+        ElementProduction.validate(self)
 
 
 NullProduction = ElementProduction(NULL)
+# the null production is shared by all grammars and always numbered 0
+NullProduction.id = 0
 
 
 class TreeNode(object):
@@ -1574,25 +2446,24 @@ class Edge(object):
     :param int dot: the dot position on the RHS. Any thing before the
                     `dot` has been consumed and after is waiting to complete
     """
-    __slots__ = ["start", "end", "prod", "dot", "_hash"]
+    __slots__ = ["start", "end", "prod", "dot", "_key", "_hash"]
 
     def __init__(self, start, end, production, dot):
-        assert start >= 0, "Error: start of edge is %d" % start
-        assert end >= 0, "Error: end of edge is %d" % end
+        # no validation here: this is the innermost parsing loop, see
+        # Chart.check_edge() for the debug mode
         self.start = start
         self.end = end
         self.prod = production
         self.dot = dot
-        # warning: hash is computed only once, we need to make sure that Edge
-        # is immutable, thus setting __slots__ above
-        self._hash = hash((self.start, self.end, self.prod, self.dot))
+        # warning: key and hash are computed only once, we need to make sure
+        # that Edge is immutable, thus setting __slots__ above. Productions
+        # are keyed by their integer ids (see GrammarImpl)
+        self._key = (start, end, production.id, dot)
+        self._hash = hash(self._key)
 
     def __eq__(self, other):
-        # eq = (self is other or
-        #       other is not None and self.start == other.start and
-        #       self.end == other.end and self.dot == other.dot and
-        #       self.prod == other.prod)
-        return hash(self) == hash(other)
+        return self is other or \
+            (isinstance(other, Edge) and self._key == other._key)
 
     def __ne__(self, other):
         return not self == other
@@ -1645,12 +2516,8 @@ class Edge(object):
             rhs = self.prod.rhs[self.dot]
 
             if rhs.is_terminal:
-                try:
-                    progress = rhs.parse(phrase)
-                except ParseException:
-                    return False, False
-                else:
-                    return progress, True
+                progress = rhs.match(phrase)
+                return progress, progress
             else:
                 return None, None
         else:
@@ -1669,16 +2536,12 @@ class Edge(object):
 
             [1, 3] NNS -> NNS * CC NNS
 
-        Requires that ``edge.start == self.end``
+        Requires that ``edge.start == self.end`` and that self is not
+        complete, which is not checked.
 
         :return: a new edge
         :rtype: :class:`Edge`
         """
-        assert edge.start == self.end, \
-            "Can't merge and forward dot: \n%s\n%s" % (self, edge)
-
-        assert self.dot < self.prod.rhs_len, \
-            "Dot position (%d) way behind RHS (%s)" % (self.dot, self)
         return Edge(self.start, edge.end, self.prod, self.dot + 1)
 
     def is_complete(self):
@@ -1986,6 +2849,17 @@ class ParseResult(object):
     def __delattr__(self, item):
         del self[item]
 
+    # needed by pickle and copy, as __getattr__ returns None for anything
+
+    def __getnewargs__(self):
+        return ()
+
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def keys(self):
         """
         Return the set of names in result
@@ -2020,16 +2894,24 @@ class ParseResult(object):
 class Chart(object):
     """
     A 2D chart (list) to store graph edges. Edges can be accessed via:
-    Chart.edges[start][end] and return value is a set of edges.
+    Chart.edges[start][end] (or :func:`get_edges`) and return value is a set
+    of edges.
+
+    Edges are kept as :class:`Edge` objects rather than packed columns: the
+    agenda and the backpointers hold every edge of the chart anyway. Parsing
+    rules call :func:`add_new_edge`, which doesn't create duplicates.
+
+    Set ``debug`` to True to check every inserted edge with
+    :func:`check_edge`.
 
     :param int size: chart size, normally ``len(tokens) + 1``.
     """
+    debug = False
 
     def __init__(self, size):
         self._init_pointers()
         self.size = size
-        self.edges = [[set() for _ in xrange(self.size)]
-                      for _ in xrange(self.size)]
+        self._init_edges()
         # current parsing progress; when chart_i = m, it means we are
         # considering the token between m-1 and m.
         self.chart_i = 0
@@ -2040,6 +2922,21 @@ class Chart(object):
         # edge [0, 3] covers, then we need to know self.lex_idx[0]'s lex_start
         # and self.lex_idx[2]'s lex_end
         self.lex_idx = [(None, None) for _ in xrange(size)]
+        # secondary indexes maintained by add_edge(), keyed by grammar
+        # element ids for the strictness of "is":
+        # (end, id(RHS after dot)) -> list of incomplete edges
+        self._incomplete_edges = {}
+        # (start, id(LHS)) -> list of complete edges
+        self._complete_edges = {}
+        # (start, end, production id, dot) -> edge, see find_edge()
+        self._edge_keys = {}
+        # scan results of the current column, see scan_terminals()
+        self._scan_cache = {}
+        self._scan_column = None
+
+    def _init_edges(self):
+        self.edges = [[set() for _ in xrange(self.size)]
+                      for _ in xrange(self.size)]
 
     def _init_pointers(self):
         # edge2backpointers hold only tuples of children edges
@@ -2120,13 +3017,66 @@ class Chart(object):
         :return bool: Whether this edge is newly inserted
                       (not already exists)
         """
-        if edge in self.edges[edge.start][edge.end]:
-            ret = False
-        else:
-            ret = True
-            self.edges[edge.start][edge.end].add(edge)
+        if self.debug:
+            self.check_edge(edge, prev_edge, child_edge)
+        ret = self._insert_edge(edge)
+        if ret:
+            self._index_edge(edge)
+
+        if child_edge:
+            self._add_backpointers(edge, prev_edge, child_edge)
+        return ret
+
+    def add_new_edge(self, start, end, prod, dot, prev_edge=None,
+                     child_edge=None, lexicon=''):
+        """
+        Same as :func:`add_edge`, but takes the fields of an edge and only
+        creates an :class:`Edge` if it isn't in the chart yet: most edges
+        formed by parsing rules are duplicates.
+
+        :return: the newly inserted edge, or None if it already exists
+        :rtype: :class:`Edge`
+        """
+        edge = self.find_edge(start, end, prod, dot)
+        if edge is not None:
+            if child_edge:
+                self._add_backpointers(edge, prev_edge, child_edge)
+            return None
+        edge = Edge(start, end, prod, dot)
+        self.add_edge(edge, prev_edge, child_edge, lexicon)
+        return edge
+
+    def find_edge(self, start, end, prod, dot):
+        """
+        Return the edge in the chart with the given fields, or None.
+
+        :rtype: :class:`Edge`
+        """
+        return self._edge_keys.get((start, end, prod.id, dot))
+
+    def check_edge(self, edge, prev_edge=None, child_edge=None):
+        """
+        Sanity check of `edge` and, if given, of the two edges it was merged
+        from. Only called by :func:`add_edge` in debug mode.
 
-        if child_edge and edge != child_edge:
+        :raise AssertionError: if the edge is malformed
+        """
+        if not 0 <= edge.start <= edge.end:
+            raise AssertionError("Error: span of edge is [%d, %d]" %
+                                 (edge.start, edge.end))
+        if not 0 <= edge.dot <= edge.prod.rhs_len:
+            raise AssertionError("Dot position (%d) out of RHS (%s)" %
+                                 (edge.dot, edge))
+        if prev_edge is not None and child_edge is not None:
+            if child_edge.start != prev_edge.end:
+                raise AssertionError("Can't merge and forward dot: \n%s\n%s"
+                                     % (prev_edge, child_edge))
+            if prev_edge.dot >= prev_edge.prod.rhs_len:
+                raise AssertionError("Dot position (%d) way behind RHS (%s)"
+                                     % (prev_edge.dot, prev_edge))
+
+    def _add_backpointers(self, edge, prev_edge, child_edge):
+        if edge != child_edge:
             # not child_edge: prevent recursion
             if edge not in self.edge2backpointers:
                 self.edge2backpointers[edge] = set()
@@ -2145,7 +3095,75 @@ class Chart(object):
                 # if len(new_child_edges) != edge.dot:
                 #   print("missing children")
 
-        return ret
+    def _insert_edge(self, edge):
+        """
+        Store `edge` in its chart cell.
+
+        :return bool: False if `edge` is already in the chart
+        """
+        cell = self.edges[edge.start][edge.end]
+        if edge in cell:
+            return False
+        cell.add(edge)
+        self._edge_keys[edge._key] = edge
+        return True
+
+    def _index_edge(self, edge):
+        if edge.dot == edge.prod.rhs_len:
+            key = (edge.start, id(edge.prod.lhs))
+            index = self._complete_edges
+        else:
+            key = (edge.end, id(edge.prod.rhs[edge.dot]))
+            index = self._incomplete_edges
+        if key in index:
+            index[key].append(edge)
+        else:
+            index[key] = [edge]
+
+    def scan_terminals(self, grammar, phrase):
+        """
+        Return the terminal productions of `grammar` parsing `phrase` (see
+        :func:`GrammarImpl.filter_terminals_for_scan`) and their bitset.
+        Results are memoized for the current column (:attr:`chart_i`), so
+        each phrase is scanned once however many rules ask for it.
+
+        :param GrammarImpl grammar: the grammar parsed with
+        :param str phrase: a phrase to be parsed
+        :return: a tuple of (list of terminal productions, bitset)
+        :rtype: tuple(list(:class:`Production`), int)
+        """
+        column = (self.chart_i, grammar)
+        if self._scan_column != column:
+            self._scan_cache = {}
+            self._scan_column = column
+        scanned = self._scan_cache.get(phrase)
+        if scanned is None:
+            prods = list(grammar.filter_terminals_for_scan(phrase))
+            scanned = (prods, grammar.production_mask(prods))
+            self._scan_cache[phrase] = scanned
+        return scanned
+
+    def get_edges(self, start, end):
+        """
+        Return the set of edges spanning from `start` to `end`.
+
+        :param int start: start position
+        :param int end: end position
+        :return: set(:class:`Edge`)
+        """
+        return self.edges[start][end]
+
+    def iter_edges(self):
+        """
+        Yield all edges in the chart.
+
+        :return: an edge generator
+        :rtype: generator(:class:`Edge`)
+        """
+        for i in xrange(self.size):
+            for j in xrange(self.size):
+                for edge in self.edges[i][j]:
+                    yield edge
 
     def filter_edges_for_prediction(self, end):
         """
@@ -2169,70 +3187,31 @@ class Chart(object):
             [1, 1] NP ->  * NNS
 
         match `end=1` and `rhs_after_dot=NNS`
+
+        :return: a list of edges
+        :rtype: list(:class:`Edge`)
         """
-        # Note: fix can't use yield
-        # the reason is that after returning, we immediately add to chart.edges
-        # which causes the size of edges to change. One solution is to
-        # first put it on agenda, then add to chart (instead of first adding
-        # to chart, then to agenda)
-        edges = []
-        # if end is not None and rhs_after_dot is not None:
-        # # edges = [edge
-        # # for i in xrange(min(self.size, end+1))
-        # #           for edge in self.edges[i][end]
-        # #             if edge.get_rhs_after_dot() is rhs_after_dot
-        # #         ]
-        for i in xrange(min(self.size, end + 1)):
-            for edge in self.edges[i][end]:
-                # replaced "==" here with "is" and got 2x speed up
-                # if edge.get_rhs_after_dot() is rhs_after_dot:
-                # avoiding the function call get_rhs_after_dot()
-                # is 15% faster
-                if edge.prod.rhs_len != edge.dot and \
-                   edge.prod.rhs[edge.dot] is rhs_after_dot:
-                    # can't yield here because Zero/Optional elements
-                    # might be # re-added to edges[i][end], then list
-                    # size changed exception yield edge
-                    edges.append(edge)
-        # elif end is None and rhs_after_dot:
-        #     for i in xrange(self.size):
-        #         for j in xrange(self.size):
-        #             for edge in self.edges[i][j]:
-        #                 # replaced "==" here with "is" and got 2x speed up
-        #                 # if edge.get_rhs_after_dot() is rhs_after_dot:
-        #                 if edge.prod.rhs_len != edge.dot and \
-        #                    edge.prod.rhs[edge.dot] is rhs_after_dot:
-        #                     # yield edge
-        #                     edges.append(edge)
-        return edges
+        # return a copy: callers add new edges to the chart while iterating
+        # (e.g., Zero/Optional elements), which would change the index
+        return list(self._incomplete_edges.get((end, id(rhs_after_dot)), ()))
 
     def filter_completed_edges(self, start, lhs):
         """
-        Find all edges with matching `start` position and LHS with `lhs`.
-        directly after the dot as `rhs_after_dot`. For instance, both edges::
+        Find all complete edges with matching `start` position and LHS with
+        `lhs`. For instance, both edges::
 
-            [1, 1] NP ->  * NNS CC NNS
-            [1, 3] NP ->  * NNS
+            [1, 2] NP -> NNS *
+            [1, 3] NP -> NNS CC NNS *
 
         match ``start=1`` and ``lhs=NP``.
 
         :return: a list of edges
         :rtype: list(:class:`Edge`)
         """
-        edges = []
-        for j in xrange(self.size):
-            for edge in self.edges[start][j]:
-                if edge.is_complete() and edge.prod.lhs is lhs:
-                    edges.append(edge)
-        return edges
+        return list(self._complete_edges.get((start, id(lhs)), ()))
 
     def __str__(self):
-        str_list = []
-        for i in xrange(self.size):
-            for j in xrange(self.size):
-                if len(self.edges[i][j]) > 0:
-                    str_list += [str(e) for e in self.edges[i][j]]
-        return "\n".join(sorted(str_list))
+        return "\n".join(sorted(str(e) for e in self.iter_edges()))
 
     def print_backpointers(self):
         """
@@ -2243,6 +3222,18 @@ class Chart(object):
             str_list.append(str(edge) + " :-> " + str(children))
         return "\n".join(sorted(str_list))
 
+    def forest(self, tokens=None, goal=None):
+        """
+        Return the packed parse forest this chart covers.
+
+        :param list tokens: a list of lexicon tokens
+        :param goal: the root of trees (usually Grammar.GOAL)
+        :type: GrammarElement, None
+        :rtype: :class:`ParseForest`
+        :raises: :class:`ParseException` if the chart is empty
+        """
+        return ParseForest(self, tokens, goal)
+
     def trees(self, tokens=None, all_trees=False, goal=None):
         """
         Yield all possible trees this chart covers. If `all_trees` is False,
@@ -2256,23 +3247,40 @@ class Chart(object):
         :return: a tuple of (tree index, TreeNode)
         :rtype: tuple(int, :class:`TreeNode`)
         """
-        i = 0
-        if self.size <= 1:
-            raise ParseException("No parse tree found")
-        else:
-            for root in self.edges[0][self.size - 1]:
-                if root.is_complete():
-                    if goal is not None and root.prod.lhs != goal:
-                        continue
-                    i += 1
-                    # print("root", i)
-                    if all_trees:
-                        for tree in self._trees(root, tokens):
-                            yield (i, tree)
-                    else:
-                        for tree in self._most_compact_trees(root, tokens):
-                            yield (i, tree)
-                            # print("number of complete root nodes:", i)
+        for i_tree in self.forest(tokens, goal).trees(all_trees):
+            yield i_tree
+
+    def best_tree(self, tokens=None, goal=None):
+        """
+        Return the best tree of this chart without enumerating trees. See
+        :func:`ParseForest.best_tree`.
+
+        :param list tokens: a list of lexicon tokens
+        :param goal: the root of this tree (usually Grammar.GOAL)
+        :type: GrammarElement, None
+        :return: the best tree
+        :rtype: :class:`TreeNode`
+        :raises: :class:`ParseException` if no tree is found
+        """
+        return self.forest(tokens, goal).best_tree()
+
+    def kbest(self, k, tokens=None, goal=None, score=None):
+        """
+        Lazily yield the `k` best trees of this chart in the order of
+        increasing score. See :func:`ParseForest.kbest`.
+
+        :param int k: the maximal number of trees to yield
+        :param list tokens: a list of lexicon tokens
+        :param goal: the root of this tree (usually Grammar.GOAL)
+        :type: GrammarElement, None
+        :param score: a function ``score(edge, children, child_scores)``,
+            default: :func:`ParseForest.tree_size_score`
+        :return: a tuple of (score, TreeNode)
+        :rtype: tuple(float, :class:`TreeNode`)
+        :raises: :class:`ParseException` if no tree is found
+        """
+        for score_tree in self.forest(tokens, goal).kbest(k, score):
+            yield score_tree
 
     def best_tree_with_parse_result(self, trees):
         """
@@ -2289,68 +3297,6 @@ class Chart(object):
             parse_result = best_tree.to_parse_result()
             return best_tree, parse_result
 
-    def _trees(self, parent_edge, tokens=None):
-        trees = []
-        lexicon = ""
-        if tokens is not None:
-            lexicon = " ".join(tokens[parent_edge.start: parent_edge.end])
-        if parent_edge in self.edge2backpointers:
-            for children_edges in self.edge2backpointers.get(parent_edge):
-                child_trees = [self._trees(child_edge, tokens) for
-                               child_edge in children_edges]
-                for t in itertools.product(*child_trees):
-                    trees.append(
-                        TreeNode(parent_edge, t, lexicon,
-                                 self.get_edge_lexical_span(parent_edge)))
-        else:
-            # leaf child edge doesn't have backpointers
-            # previous edges do, but we are only retrieving child edges
-            trees = [TreeNode(parent_edge, [], lexicon,
-                              self.get_edge_lexical_span(parent_edge))]
-
-        return trees
-
-    def _most_compact_trees(self, parent_edge, tokens=None):
-        """
-        Try to eliminate spurious ambiguities by getting the most
-        compact/flat tree. This mainly deals with removing Optional/ZeroOrMore
-        nodes
-        """
-        trees = []
-        lexicon = ""
-        if tokens is not None:
-            lexicon = " ".join(tokens[parent_edge.start: parent_edge.end])
-        if parent_edge in self.edge2backpointers:
-            # to improve efficiency, we can use a priority queue
-            # for self.edge2backpointers
-            ss = sorted(
-                [(len(children_edges), children_edges) for children_edges
-                 in self.edge2backpointers[parent_edge]])
-            min_child_num = ss[0][0]
-            # there could be multiple backpointers of the same size
-            min_children_edges = [c for l, c in ss if l == min_child_num]
-
-            child_trees_list = []
-            for children_edges in min_children_edges:
-                child_trees = [self._most_compact_trees(child_edge, tokens)
-                               for child_edge in children_edges]
-                child_trees_list.append(child_trees)
-            # we select from whoever's children are the smallest
-            cc = sorted([(sum([t[0].size() for t in c_trees]),
-                          c_trees) for c_trees in child_trees_list])
-            child_trees = cc[0][1]
-            for t in itertools.product(*child_trees):
-                trees.append(
-                    TreeNode(parent_edge, t, lexicon,
-                             self.get_edge_lexical_span(parent_edge)))
-        else:
-            # leaf child edge doesn't have backpointers
-            # previous edges do, but we are only retrieving child edges
-            trees = [TreeNode(parent_edge, [], lexicon,
-                              self.get_edge_lexical_span(parent_edge))]
-
-        return trees
-
 
 class IncrementalChart(Chart):
     """
@@ -2361,12 +3307,17 @@ class IncrementalChart(Chart):
     :param int max_size: total capacity of chart, if exceeded, then
       need to increase by ``inc_size``.
     :param int inc_size: size to increase when max_size is filled
+    :param float growth_factor: if set (e.g., 2.0), grow the capacity
+      geometrically to ``max_size * growth_factor`` (at least by
+      ``inc_size``) instead, so that streaming a long sentence token by token
+      re-pads the rows only a logarithmic number of times.
     """
 
-    def __init__(self, init_size=10, inc_size=10):
+    def __init__(self, init_size=10, inc_size=10, growth_factor=None):
         """
         :param init_size: the initial size
         :param inc_size: extra size to span when the chart is filled up
+        :param growth_factor: capacity multiplier when the chart is filled up
         """
         super(IncrementalChart, self).__init__(init_size)
         # actual size that has been used
@@ -2374,30 +3325,580 @@ class IncrementalChart(Chart):
         # total capacity
         self.max_size = init_size
         self.inc_size = inc_size
+        self.growth_factor = growth_factor
 
-    def increase_capacity(self):
+    def increase_capacity(self, min_size=None):
         """
-        Increase the capacity of the current chart by `self.inc_size`
+        Increase the capacity of the current chart by `self.inc_size`, or to
+        `self.growth_factor` times if set, and to at least `min_size`.
+
+        :param int min_size: minimal capacity after increasing
         """
+        new_size = self.max_size + self.inc_size
+        if self.growth_factor:
+            new_size = max(new_size, int(self.max_size * self.growth_factor))
+        if min_size is not None:
+            new_size = max(new_size, min_size)
+        inc_size = new_size - self.max_size
 
         # padding horizontally -->>
         for i in xrange(self.max_size):
-            self.edges[i] += [set() for _ in xrange(self.inc_size)]
+            self.edges[i] += [set() for _ in xrange(inc_size)]
 
         # padding vertically --vv
-        self.edges += [[set() for _ in xrange(self.max_size + self.inc_size)]
-                       for _ in xrange(self.inc_size)]
-        self.max_size += self.inc_size
-        self.lex_idx += [(None, None) for _ in xrange(self.inc_size)]
+        self.edges += [[set() for _ in xrange(new_size)]
+                       for _ in xrange(inc_size)]
+        self.max_size = new_size
+        self.lex_idx += [(None, None) for _ in xrange(inc_size)]
+
+    def reserve(self, n):
+        """
+        Make sure the chart holds `n` tokens without increasing its
+        capacity again, e.g., when the utterance length is known beforehand.
+
+        :param int n: number of tokens
+        """
+        # n tokens take n+1 positions, and add_edge() increases capacity
+        # as soon as size reaches max_size
+        if self.max_size < n + 2:
+            self.increase_capacity(n + 2)
 
     def add_edge(self, edge, prev_edge, child_edge, lexicon=''):
         if edge.end >= self.size:
             self.size = edge.end + 1
         if self.size >= self.max_size:
-            self.increase_capacity()
+            self.increase_capacity(self.size + 1)
         return Chart.add_edge(self, edge, prev_edge, child_edge, lexicon)
 
 
+class _SparseEdges(object):
+    """
+    Read-only ``edges[start][end]`` view of a :class:`SparseChart`, as
+    long as its lexical span list.
+    """
+    __slots__ = ["chart", "start"]
+
+    def __init__(self, chart, start=None):
+        self.chart = chart
+        self.start = start
+
+    def __len__(self):
+        return len(self.chart.lex_idx)
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if self.start is None:
+            return _SparseEdges(self.chart, i)
+        return self.chart.get_edges(self.start, i)
+
+
+class SparseChart(Chart):
+    """
+    A drop-in replacement of :class:`Chart` that only stores populated
+    cells: edges are kept in a dictionary keyed by ``(start, end)`` and in
+    a list per end position, instead of a ``size * size`` list of sets.
+    Most cells of a chart stay empty in practice, thus this saves memory and
+    allocation time on long sentences.
+
+    ``Chart.edges[start][end]`` is a read-only view here: add edges with
+    :func:`add_edge` as usual, empty cells are shared frozen sets.
+
+    :param int size: chart size, normally ``len(tokens) + 1``.
+    """
+    _EMPTY = frozenset()
+
+    @property
+    def edges(self):
+        return _SparseEdges(self)
+
+    def _init_edges(self):
+        # (start, end) -> set of edges
+        self._cells = {}
+        # end -> list of edges
+        self._ends = {}
+
+    def _insert_edge(self, edge):
+        key = (edge.start, edge.end)
+        cell = self._cells.get(key)
+        if cell is None:
+            self._cells[key] = {edge}
+        elif edge in cell:
+            return False
+        else:
+            cell.add(edge)
+        if edge.end in self._ends:
+            self._ends[edge.end].append(edge)
+        else:
+            self._ends[edge.end] = [edge]
+        self._edge_keys[edge._key] = edge
+        return True
+
+    def get_edges(self, start, end):
+        return self._cells.get((start, end), self._EMPTY)
+
+    def iter_edges(self):
+        for cell in self._cells.values():
+            for edge in cell:
+                yield edge
+
+    def filter_edges_for_prediction(self, end):
+        return list(self._ends.get(end, ()))
+
+
+class SparseIncrementalChart(SparseChart):
+    """
+    A drop-in replacement of :class:`IncrementalChart` on top of
+    :class:`SparseChart`. There are no cells to pad when the chart grows,
+    only the list of lexical spans is extended, and it always doubles:
+    `inc_size` and `growth_factor` are accepted but ignored.
+
+    :param int init_size: initial length of the lexical span list
+    """
+
+    def __init__(self, init_size=10, inc_size=10, growth_factor=None):
+        super(SparseIncrementalChart, self).__init__(init_size)
+        # actual size that has been used
+        self.size = 0
+        self.inc_size = inc_size
+        self.growth_factor = growth_factor
+
+    @property
+    def max_size(self):
+        """
+        Total capacity of the chart, the length of the lexical span list.
+        """
+        return len(self.lex_idx)
+
+    def increase_capacity(self, min_size=None):
+        """
+        Double the capacity of the chart, and to at least `min_size`.
+
+        :param int min_size: minimal capacity after increasing
+        """
+        self.reserve(max(2 * self.max_size, min_size or 0) - 2)
+
+    def reserve(self, n):
+        """
+        Make sure the lexical span list holds `n` tokens without being
+        extended again.
+
+        :param int n: number of tokens
+        """
+        if len(self.lex_idx) < n + 2:
+            self.lex_idx += [(None, None)] * (n + 2 - len(self.lex_idx))
+
+    def add_edge(self, edge, prev_edge, child_edge, lexicon=''):
+        if edge.end >= self.size:
+            self.size = edge.end + 1
+            if self.size >= len(self.lex_idx):
+                # double the list to amortize the extension
+                self.increase_capacity(self.size + 2)
+        return SparseChart.add_edge(self, edge, prev_edge, child_edge,
+                                    lexicon)
+
+
+class ParseForest(object):
+    """
+    A shared packed parse forest over the backpointers of a :class:`Chart`:
+    every complete edge is a node, and every tuple of children edges in
+    :attr:`Chart.edge2backpointers` is one packed way of deriving it.
+    Derivations are counted, pruned and selected over the forest, and only
+    the selected ones are unpacked into :class:`TreeNode`.
+
+    :param Chart chart: a parsed chart
+    :param list tokens: a list of lexicon tokens
+    :param goal: the root of trees (usually Grammar.GOAL), or None for any
+        complete edge spanning the whole chart
+    :type: GrammarElement, None
+    :param dict edge2backpointers: backpointers of the forest, default to
+        the ones of `chart`
+    :raises: :class:`ParseException` if the chart is empty
+    """
+
+    def __init__(self, chart, tokens=None, goal=None, edge2backpointers=None):
+        if chart.size <= 1:
+            raise ParseException("No parse tree found")
+        self.chart = chart
+        self.tokens = tokens
+        self.goal = goal
+        if edge2backpointers is None:
+            edge2backpointers = chart.edge2backpointers
+        self.edge2backpointers = edge2backpointers
+        self.roots = []
+        for root in chart.get_edges(0, chart.size - 1):
+            if root.is_complete():
+                if goal is not None and root.prod.lhs != goal:
+                    continue
+                self.roots.append(root)
+        # subtrees of edges shared by several parents are only built once
+        self._compact_memo = {}
+        self._all_tree_memo = {}
+        self._compact_tree_memo = {}
+
+    def children(self, edge):
+        """
+        Return the packed ways of deriving `edge`.
+
+        :param Edge edge: an edge of this forest
+        :return: a list of tuples of children edges (empty for leaves)
+        :rtype: list(tuple(:class:`Edge`))
+        """
+        return list(self.edge2backpointers.get(edge, []))
+
+    def count(self, edge=None):
+        """
+        Count derivations (trees) without unpacking them.
+
+        :param Edge edge: count trees under `edge`, or under all roots if
+            None
+        :rtype: int
+        """
+        memo = {}
+
+        def count(e):
+            if e in memo:
+                return memo[e]
+            # cyclic derivations are not counted
+            memo[e] = 0
+            if e in self.edge2backpointers:
+                n = 0
+                for children_edges in self.edge2backpointers[e]:
+                    product = 1
+                    for child_edge in children_edges:
+                        product *= count(child_edge)
+                    n += product
+            else:
+                n = 1
+            memo[e] = n
+            return n
+
+        if edge is not None:
+            return count(edge)
+        return sum(count(root) for root in self.roots)
+
+    def prune(self, predicate):
+        """
+        Return a new forest keeping only the edges `predicate` accepts.
+        Derivations going through a removed edge are removed, and so are
+        edges left with no derivation.
+
+        :param predicate: a function taking an :class:`Edge` and returning
+            True to keep it
+        :rtype: :class:`ParseForest`
+        """
+        alive = {}
+        edge2backpointers = {}
+
+        def is_alive(edge):
+            if edge in alive:
+                return alive[edge]
+            # cyclic derivations are dropped
+            alive[edge] = False
+            if not predicate(edge):
+                return False
+            if edge in self.edge2backpointers:
+                kept = set(c for c in self.edge2backpointers[edge]
+                           if all([is_alive(e) for e in c]))
+                if not kept:
+                    return False
+                edge2backpointers[edge] = kept
+            alive[edge] = True
+            return True
+
+        for root in self.roots:
+            is_alive(root)
+        forest = ParseForest(self.chart, self.tokens, self.goal,
+                             edge2backpointers)
+        forest.roots = [r for r in self.roots if alive[r]]
+        return forest
+
+    def trees(self, all_trees=False):
+        """
+        Yield the trees of this forest. If `all_trees` is False, then only
+        the most compact trees for each root are yielded. Otherwise yield
+        all trees (**warning: can be thousands**).
+
+        :param bool all_trees: if False, then only yield the smallest trees
+        :return: a tuple of (root index, TreeNode)
+        :rtype: tuple(int, :class:`TreeNode`)
+        """
+        for i, root in enumerate(self.roots, 1):
+            if all_trees:
+                for tree in self._trees(root):
+                    yield (i, tree)
+            else:
+                for tree in self._most_compact_trees(root):
+                    yield (i, tree)
+
+    def best_tree(self):
+        """
+        Return the smallest tree among the most compact trees (the same
+        tree :func:`Chart.best_tree_with_parse_result` picks from
+        ``trees(all_trees=False)``) without enumerating them: a dynamic
+        programming pass over backpointers computes the best tree size of
+        every edge once, then only the single best :class:`TreeNode` is
+        built.
+
+        :return: the best tree
+        :rtype: :class:`TreeNode`
+        :raises: :class:`ParseException` if no tree is found
+        """
+        best_root, best_size = None, None
+        for root in self.roots:
+            derivation = self._compact_derivation(root)
+            if derivation is not None and \
+                    (best_size is None or derivation[0] < best_size):
+                best_root, best_size = root, derivation[0]
+        if best_root is None:
+            raise ParseException("No parse tree found")
+        return self._compact_tree(best_root)
+
+    def best_parse(self):
+        """
+        Return a tuple of :func:`best_tree` and its parse result.
+
+        :rtype: tuple(:class:`TreeNode`, :class:`ParseResult`)
+        :raises: :class:`ParseException` if no tree is found
+        """
+        best_tree = self.best_tree()
+        return best_tree, best_tree.to_parse_result()
+
+    @staticmethod
+    def tree_size_score(edge, children, child_scores):
+        """
+        Default score of :func:`kbest`: the size of the tree built under
+        `edge`, as counted by :func:`TreeNode.size`.
+
+        :param Edge edge: the parent edge
+        :param tuple children: a tuple of child :class:`Edge`
+        :param list child_scores: scores of the subtrees under `children`
+        :rtype: int
+        """
+        size = 1 + sum(child_scores)
+        if edge.prod.is_recursive:
+            # TreeNode flattens recursive productions by replacing
+            # a child with the same LHS with its own children
+            lhs = edge.prod.lhs
+            size -= sum(1 for c in children if c.prod.lhs is lhs)
+        return size
+
+    def kbest(self, k, score=None):
+        """
+        Lazily yield the `k` best trees of this forest in the order of
+        increasing score, following the lazy k-best algorithm (Algorithm 3)
+        of Huang and Chiang (2005) over the backpointer hypergraph: each edge
+        only keeps as many of its best subtrees as have been asked for, so
+        memory is bounded by `k` per edge.
+
+        :param int k: the maximal number of trees to yield
+        :param score: a function ``score(edge, children, child_scores)``
+            returning the score of a tree (lower is better) from the scores
+            of its subtrees. It must not decrease when a child score
+            increases. Default: :func:`tree_size_score`
+        :return: a tuple of (score, TreeNode)
+        :rtype: tuple(float, :class:`TreeNode`)
+        :raises: :class:`ParseException` if no tree is found
+        """
+        if score is None:
+            score = self.tree_size_score
+        counter = itertools.count()
+        # edge -> list of (score, backpointer index, child ranks)
+        derivations = {}
+        # edge -> [candidate heap, set of pushed candidates, #expanded]
+        candidates = {}
+        in_progress = set()
+        edge2bps = {}
+
+        def backpointers(edge):
+            if edge not in edge2bps:
+                edge2bps[edge] = sorted(
+                    self.edge2backpointers.get(edge, [()]),
+                    key=lambda c: [(e.start, e.end) for e in c])
+            return edge2bps[edge]
+
+        def push(edge, cand, seen, bp_idx, children, ranks):
+            if (bp_idx, ranks) in seen:
+                return
+            child_scores = []
+            for child, rank in zip(children, ranks):
+                if rank >= k or get(child, rank) is None:
+                    return
+                child_scores.append(derivations[child][rank][0])
+            seen.add((bp_idx, ranks))
+            heapq.heappush(cand, (score(edge, children, child_scores),
+                                  next(counter), bp_idx, ranks))
+
+        def get(edge, rank):
+            """the `rank`-th best derivation of `edge`, or None"""
+            derived = derivations.setdefault(edge, [])
+            if rank < len(derived):
+                return derived[rank]
+            if edge in in_progress:
+                # skip cyclic derivations
+                return None
+            in_progress.add(edge)
+            bps = backpointers(edge)
+            if edge not in candidates:
+                candidates[edge] = [[], set(), 0]
+                for i, children in enumerate(bps):
+                    push(edge, candidates[edge][0], candidates[edge][1], i,
+                         children, (0,) * len(children))
+            state = candidates[edge]
+            cand, seen = state[0], state[1]
+            while len(derived) <= rank:
+                # push the neighbours of derivations popped so far
+                for _, bp_idx, ranks in derived[state[2]:]:
+                    for j in xrange(len(ranks)):
+                        new_ranks = ranks[:j] + (ranks[j] + 1,) + ranks[j+1:]
+                        push(edge, cand, seen, bp_idx, bps[bp_idx],
+                             new_ranks)
+                state[2] = len(derived)
+                if not cand:
+                    break
+                s, _, bp_idx, ranks = heapq.heappop(cand)
+                derived.append((s, bp_idx, ranks))
+            in_progress.discard(edge)
+            return derived[rank] if rank < len(derived) else None
+
+        def build(edge, rank):
+            _, bp_idx, ranks = derivations[edge][rank]
+            children = [build(child, r) for child, r in
+                        zip(backpointers(edge)[bp_idx], ranks)]
+            return self._tree_node(edge, children)
+
+        roots = []
+        for root in self.roots:
+            if get(root, 0) is not None:
+                heapq.heappush(roots, (derivations[root][0][0],
+                                       next(counter), root, 0))
+        if not roots:
+            raise ParseException("No parse tree found")
+        for _ in xrange(k):
+            if not roots:
+                break
+            s, _, root, rank = heapq.heappop(roots)
+            yield (s, build(root, rank))
+            if rank + 1 < k and get(root, rank + 1) is not None:
+                heapq.heappush(roots, (derivations[root][rank + 1][0],
+                                       next(counter), root, rank + 1))
+
+    def _tree_node(self, edge, children):
+        lexicon = ""
+        if self.tokens is not None:
+            lexicon = " ".join(self.tokens[edge.start: edge.end])
+        return TreeNode(edge, children, lexicon,
+                        self.chart.get_edge_lexical_span(edge))
+
+    def _compact_derivation(self, edge):
+        """
+        Return (tree size, children edges) of the best tree under `edge`:
+        backpointers with the fewest children are preferred (see
+        :func:`_most_compact_trees`), then the smallest tree size as
+        counted by :func:`TreeNode.size`. Results are memoized.
+
+        :return: a tuple of (int, tuple(:class:`Edge`)), or None if `edge`
+            only derives itself
+        """
+        memo = self._compact_memo
+        if edge in memo:
+            return memo[edge]
+        # mark as in progress, so cyclic derivations are skipped
+        memo[edge] = None
+        if edge in self.edge2backpointers:
+            best = None
+            backpointers = self.edge2backpointers[edge]
+            min_child_num = min(len(c) for c in backpointers)
+            lhs, is_recursive = edge.prod.lhs, edge.prod.is_recursive
+            for children_edges in backpointers:
+                if len(children_edges) != min_child_num:
+                    continue
+                size = 1
+                for child_edge in children_edges:
+                    derivation = self._compact_derivation(child_edge)
+                    if derivation is None:
+                        break
+                    size += derivation[0]
+                    # TreeNode flattens recursive productions by replacing
+                    # a child with the same LHS with its own children
+                    if is_recursive and child_edge.prod.lhs is lhs:
+                        size -= 1
+                else:
+                    if best is None or size < best[0]:
+                        best = (size, children_edges)
+        else:
+            best = (1, ())
+        memo[edge] = best
+        return best
+
+    def _compact_tree(self, edge):
+        children = [self._compact_tree(child_edge)
+                    for child_edge in self._compact_memo[edge][1]]
+        return self._tree_node(edge, children)
+
+    def _trees(self, parent_edge):
+        """
+        Return all trees under `parent_edge`.
+        """
+        tree_memo = self._all_tree_memo
+        if parent_edge in tree_memo:
+            return tree_memo[parent_edge]
+        trees = []
+        if parent_edge in self.edge2backpointers:
+            for children_edges in self.edge2backpointers.get(parent_edge):
+                child_trees = [self._trees(child_edge)
+                               for child_edge in children_edges]
+                for t in itertools.product(*child_trees):
+                    trees.append(self._tree_node(parent_edge, t))
+        else:
+            # leaf child edge doesn't have backpointers
+            # previous edges do, but we are only retrieving child edges
+            trees = [self._tree_node(parent_edge, [])]
+
+        tree_memo[parent_edge] = trees
+        return trees
+
+    def _most_compact_trees(self, parent_edge):
+        """
+        Try to eliminate spurious ambiguities by getting the most
+        compact/flat tree. This mainly deals with removing Optional/ZeroOrMore
+        nodes
+        """
+        tree_memo = self._compact_tree_memo
+        if parent_edge in tree_memo:
+            return tree_memo[parent_edge]
+        trees = []
+        if parent_edge in self.edge2backpointers:
+            # to improve efficiency, we can use a priority queue
+            # for self.edge2backpointers
+            ss = sorted(
+                [(len(children_edges), children_edges) for children_edges
+                 in self.edge2backpointers[parent_edge]])
+            min_child_num = ss[0][0]
+            # there could be multiple backpointers of the same size
+            min_children_edges = [c for l, c in ss if l == min_child_num]
+
+            # we select from whoever's children are the smallest
+            def children_size(children_edges):
+                derivations = [self._compact_derivation(c)
+                               for c in children_edges]
+                if any(d is None for d in derivations):
+                    return float("inf")
+                return sum(d[0] for d in derivations)
+            children_edges = min(min_children_edges, key=children_size)
+            child_trees = [self._most_compact_trees(child_edge)
+                           for child_edge in children_edges]
+            for t in itertools.product(*child_trees):
+                trees.append(self._tree_node(parent_edge, t))
+        else:
+            # leaf child edge doesn't have backpointers
+            # previous edges do, but we are only retrieving child edges
+            trees = [self._tree_node(parent_edge, [])]
+
+        tree_memo[parent_edge] = trees
+        return trees
+
+
 # ############## Parsing Rules ##############
 # Optimization tricks with closure:
 # http://tech.magnetic.com/2015/05/optimize-python-with-closures.html
@@ -2421,13 +3922,13 @@ class TopDownInitRule(ChartRule):
     def apply(self, chart, grammar, agenda, phrase):
         if chart.size == 0:
             for prod in grammar.goal_productions:
-                edge = Edge(0, 0, prod, 0)
-                if chart.add_edge(edge, None, None):
+                edge = chart.add_new_edge(0, 0, prod, 0)
+                if edge:
                     agenda.append(edge)
             if len(agenda) == 0:  # corner case: no nonterminals
                 for prod in grammar.productions:
-                    edge = Edge(0, 0, prod, 0)
-                    if chart.add_edge(edge, None, None):
+                    edge = chart.add_new_edge(0, 0, prod, 0)
+                    if edge:
                         agenda.append(edge)
         # agenda is always empty whenever this function is called,
         # we have to fill it with chart edges and do the prediction again
@@ -2445,10 +3946,11 @@ class BottomUpScanRule(ChartRule):
 
     def apply(self, chart, grammar, agenda, phrase):
         current_lexicon_progressed_by_grammar = False
-        for prod in grammar.filter_terminals_for_scan(phrase):
-            edge = Edge(chart.chart_i-1, chart.chart_i, prod, prod.rhs_len)
+        for prod in chart.scan_terminals(grammar, phrase)[0]:
             current_lexicon_progressed_by_grammar = True
-            if chart.add_edge(edge, None, None, lexicon=phrase):
+            edge = chart.add_new_edge(chart.chart_i-1, chart.chart_i, prod,
+                                      prod.rhs_len, lexicon=phrase)
+            if edge:
                 agenda.append(edge)
         return current_lexicon_progressed_by_grammar
 
@@ -2469,8 +3971,8 @@ class TopDownPredictRule(ChartRule):
             return False
         for prod in grammar.filter_productions_for_prediction_by_lhs(rhs):
             # no lookahead, just add everything
-            predicted_edge = Edge(edge.end, edge.end, prod, 0)
-            if chart.add_edge(predicted_edge, None, None):
+            predicted_edge = chart.add_new_edge(edge.end, edge.end, prod, 0)
+            if predicted_edge:
                 agenda.append(predicted_edge)
         return False
 
@@ -2486,38 +3988,36 @@ class LeftCornerPredictScanRule(ChartRule):
         if edge.is_complete():
             return False
         rhs = edge.get_rhs_after_dot()
-        productions = set()
         if rhs.is_terminal:
-            productions.add(grammar.terminal2prod[rhs])
+            productions = (grammar.terminal2prod[rhs],)
         else:
-            productions.update(grammar.nonterminal2prod[rhs])
+            productions = grammar.nonterminal2prod[rhs]
         current_lexicon_progressed_by_grammar = False
+        # bitset of terminals parsing the phrase
+        scanned = None
 
         for prod in productions:
-            for term in grammar.get_left_corner_terminals(prod):
-                progress = False
-                try:
-                    progress = term.lhs.parse(phrase)
-                except ParseException:
-                    pass
-
-                if progress:
-                    current_lexicon_progressed_by_grammar = True
-                    edge = Edge(chart.chart_i-1, chart.chart_i, term,
-                                term.rhs_len)
-                    if chart.add_edge(edge, None, None, lexicon=phrase):
-                        agenda.append(edge)
+            lc_mask = grammar.get_left_corner_terminal_mask(prod)
+            if not lc_mask:
+                continue
+            if scanned is None:
+                scanned = chart.scan_terminals(grammar, phrase)[1]
+            for term in grammar.productions_of(lc_mask & scanned):
+                current_lexicon_progressed_by_grammar = True
+                edge = chart.add_new_edge(chart.chart_i-1, chart.chart_i,
+                                          term, term.rhs_len, lexicon=phrase)
+                if edge:
+                    agenda.append(edge)
 
-                    # Prediction
-                    if prod.is_terminal:  # don't predict terminal
-                        continue
-                    for nonterm in grammar.get_left_corner_nonterminals(prod):
-                        if term in grammar.get_left_corner_terminals(nonterm):
-                            # just add, then let CompleteRule finish the edge
-                            predicted_edge = Edge(chart.chart_i-1,
-                                                  chart.chart_i-1, nonterm, 0)
-                            if chart.add_edge(predicted_edge, None, None):
-                                agenda.append(predicted_edge)
+                # Prediction
+                if prod.is_terminal:  # don't predict terminal
+                    continue
+                for nonterm in grammar.get_left_corner_predictions(prod, term):
+                    # just add, then let CompleteRule finish the edge
+                    predicted_edge = chart.add_new_edge(
+                        chart.chart_i-1, chart.chart_i-1, nonterm, 0)
+                    if predicted_edge:
+                        agenda.append(predicted_edge)
         return current_lexicon_progressed_by_grammar
 
 
@@ -2534,8 +4034,9 @@ class BottomUpPredictRule(ChartRule):
         for production in grammar.\
                 filter_productions_for_prediction_by_rhs(edge.prod.lhs):
             # no lookahead, just add everything
-            predicted_edge = Edge(edge.start, edge.start, production, 0)
-            if chart.add_edge(predicted_edge, None, None):
+            predicted_edge = chart.add_new_edge(edge.start, edge.start,
+                                                production, 0)
+            if predicted_edge:
                 agenda.append(predicted_edge)
         return False
 
@@ -2551,13 +4052,15 @@ class TopDownScanRule(ChartRule):
             return False
         if edge.end + 1 != chart.chart_i:
             return False
-        lex_progress, rhs_progress = edge.scan_after_dot(phrase)
-        if lex_progress:
-            prod = grammar.terminal2prod[edge.prod.rhs[edge.dot]]
-
-            scanned_edge = Edge(chart.chart_i-1, chart.chart_i,
-                                prod, prod.rhs_len)
-            if chart.add_edge(scanned_edge, None, None, phrase):
+        rhs = edge.get_rhs_after_dot()
+        if not rhs.is_terminal:
+            return False
+        prod = grammar.terminal2prod[rhs]
+        if prod in chart.scan_terminals(grammar, phrase)[0]:
+            scanned_edge = chart.add_new_edge(chart.chart_i-1, chart.chart_i,
+                                              prod, prod.rhs_len,
+                                              lexicon=phrase)
+            if scanned_edge:
                 agenda.append(scanned_edge)
             return True
         else:
@@ -2572,25 +4075,29 @@ class CompleteRule(ChartRule):
     """
     NUM_EDGES = 1
 
+    # the edge merge_and_forward_dot() would form is only created by
+    # Chart.add_new_edge() if it isn't in the chart yet
+
     def apply_complete(self, edge, chart, agenda):
         for filtered_edge in chart.filter_edges_for_completion(
                 end=edge.start, rhs_after_dot=edge.prod.lhs):
-
-            # print("filtered edge", str(filtered_edge))
-            moved_edge = filtered_edge.merge_and_forward_dot(edge)
-            # print("moved edge", str(moved_edge))
-            if edge != moved_edge:
-                if chart.add_edge(moved_edge, filtered_edge, edge):
+            start, dot = filtered_edge.start, filtered_edge.dot + 1
+            if (start, edge.end, filtered_edge.prod.id, dot) != edge._key:
+                moved_edge = chart.add_new_edge(
+                    start, edge.end, filtered_edge.prod, dot,
+                    filtered_edge, edge)
+                if moved_edge:
                     agenda.append(moved_edge)
 
     def apply_incomplete(self, edge, chart, agenda):
         for filtered_edge in chart.filter_completed_edges(
                 start=edge.end, lhs=edge.prod.rhs[edge.dot]):
-
-            moved_edge = edge.merge_and_forward_dot(filtered_edge)
-            if edge != moved_edge:
-                added = chart.add_edge(moved_edge, edge, filtered_edge)
-                if added:
+            end = filtered_edge.end
+            if (edge.start, end, edge.prod.id, edge.dot + 1) != edge._key:
+                moved_edge = chart.add_new_edge(
+                    edge.start, end, edge.prod, edge.dot + 1,
+                    edge, filtered_edge)
+                if moved_edge:
                     agenda.append(moved_edge)
 
     def apply(self, chart, grammar, agenda, edge, phrase):
@@ -2652,34 +4159,123 @@ LeftCornerStrategy = ParsingStrategy([
 """Top-down left corner parsing strategy to speed up top-down strategy"""
 
 
+# parser of a worker process of RobustParser.parse_batch()
+_batch_parser = None
+
+
+def _fork_pool(workers, parser):
+    """
+    Return a pool of `workers` processes forked from this one, which inherit
+    `parser` instead of unpickling it, or None if processes can't be forked.
+    """
+    if sys.platform == "win32":
+        return None
+    context = multiprocessing
+    if hasattr(multiprocessing, "get_context"):
+        context = multiprocessing.get_context("fork")
+    return context.Pool(workers, _init_batch_worker, (parser,))
+
+
+def _init_batch_worker(parser):
+    global _batch_parser
+    _batch_parser = parser
+
+
+def _parse_batch_item(parser, sent):
+    try:
+        return parser.parse(sent)[1], None
+    except Exception as e:
+        return None, "%s: %s" % (e.__class__.__name__, e)
+
+
+def _parse_batch_chunk(sents):
+    """
+    Parse `sents` in a worker process. Results are pickled one by one here,
+    so that a result which can't be pickled is reported as its own error.
+    """
+    parsed = []
+    for sent in sents:
+        result, error = _parse_batch_item(_batch_parser, sent)
+        try:
+            result = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            result, error = None, "%s: %s" % (e.__class__.__name__, e)
+        parsed.append((result, error))
+    return parsed
+
+
+def _session_property(name):
+    return property(lambda self: getattr(self.session, name),
+                    lambda self, value: setattr(self.session, name, value),
+                    doc="`%s` of the :attr:`session` of the calling thread"
+                        % name)
+
+
 class RobustParser(object):
     """
     A robust, incremental chart parser.
 
+    A parser doesn't change while parsing: per-utterance state is kept in
+    a :class:`ParseSession`, thus one parser can be shared by threads.
+    Incremental parsing methods of the parser use a default session per
+    thread (:attr:`session`), or see :func:`new_session`.
+
     :param grammar: user defined grammar, a :class:`GrammarImpl` type.
     :param ParsingStrategy strategy: top-down or bottom-up parsing
+    :param chart_class: chart to parse into, :class:`IncrementalChart` or
+        :class:`SparseIncrementalChart` (better for long sentences)
+    :param bool debug: check every chart edge (slow), see
+        :func:`Chart.check_edge`
+    :param dict chart_kwargs: keyword arguments of `chart_class`, e.g.,
+        ``{"growth_factor": 2.0}`` to grow the chart geometrically while
+        streaming long sentences token by token
     """
-    def __init__(self, grammar, strategy=LeftCornerStrategy):
+    def __init__(self, grammar, strategy=LeftCornerStrategy,
+                 chart_class=IncrementalChart, debug=False,
+                 chart_kwargs=None):
         self.logger = logging.getLogger(__name__)
         self.goal = grammar.goal
         self.grammar = grammar
-
-        # for incremental parsing:
-        self.to_be_parsed = []
-        self.accepted_tokens = []
-        self.chart = None
         self.strategy = strategy
+        self.chart_class = chart_class
+        self.chart_kwargs = dict(chart_kwargs or {})
+        self.debug = debug
         if strategy.is_leftcorder():
             self.grammar.build_leftcorner_table()
+        # default sessions, one per thread
+        self._local = threading.local()
+
+    # state of the default session, for incremental parsing
+    chart = _session_property("chart")
+    to_be_parsed = _session_property("to_be_parsed")
+    to_be_parsed_offset = _session_property("to_be_parsed_offset")
+    accepted_tokens = _session_property("accepted_tokens")
+
+    @property
+    def session(self):
+        """
+        The default :class:`ParseSession` of the calling thread.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = ParseSession(self)
+        return session
+
+    def new_session(self):
+        """
+        Create a new session to incrementally parse an utterance with this
+        parser, independent of other sessions and of the default one.
+
+        :rtype: :class:`ParseSession`
+        """
+        return ParseSession(self)
 
     def clear_cache(self):
         """
         Clear all history when the parser is to parse another sentence. Mainly
         used in server mode for incremental parsing
         """
-        self.to_be_parsed = []
-        self.accepted_tokens = []
-        self.chart = None
+        self.session.clear()
 
     def parse_to_chart(self, string):
         """
@@ -2693,88 +4289,47 @@ class RobustParser(object):
         """
         return self.parse_multi_token_skip_reuse_chart(string)
 
-    def incremental_parse_to_chart(self, single_token, chart):
+    def parse_to_forest(self, string):
         """
-        Incremental parsing one token each time. Returns
-        (chart, is_token_accepted).
+        Parse a whole sentence into a packed parse forest, so ambiguous
+        parses can be counted, pruned and ranked without unpacking all
+        trees.
 
-        :param str single_token: a single word
-        :param RobustChart chart: the previous returned chart. On first call,
-                      set it to None.
-        :return: a tuple of (chart, parsed_tokens)
+        :param str string: input sentence that's already tokenized.
+        :return: parse forest rooted at the grammar goal
+        :rtype: :class:`ParseForest`
         """
-        if chart is None:
-            self.to_be_parsed = []
-        self.to_be_parsed.append(single_token)
-        num = len(self.to_be_parsed)
-
-        # "please turn off"
-        # please -> no parse, save ["please"]
-        # please turn ->
-        # -> "please turn" no parse
-        #   -> "turn" no parse
-        #   -> save ["please turn"]
-        # please turn off ->
-        #   -> "please turn off" no parse, save it
-        #   -> "turn off" parse, return, save []
-        progress = 0
-        is_parsed = False
-        parsed_tokens = []
-        while progress < num and not is_parsed:
-            single_list = [" ".join(self.to_be_parsed[progress:])]
-            (chart, parsed_tokens) = self._parse_multi_token(
-                single_list, chart, progress)
-            is_parsed = len(parsed_tokens) > 0
-            if is_parsed:
-                self.to_be_parsed = []
-            progress += 1
+        chart, tokens = self.parse_to_chart(string)
+        self.chart = chart
+        return chart.forest(tokens, goal=self.goal)
 
-        return chart, parsed_tokens
+    def incremental_parse_to_chart(self, single_token, chart):
+        """
+        Incremental parsing one token each time in the :attr:`session` of
+        the calling thread, see
+        :func:`ParseSession.incremental_parse_to_chart`.
+        """
+        return self.session.incremental_parse_to_chart(single_token, chart)
 
     def incremental_parse(self, single_token, is_final, only_goal=True,
                           is_first=False):
         """
-        Incremental parsing one token each time. Returns the best parsing tree
-        and parse result.
-
-        :param str single_token: a single word
-        :param bool is_final: whether the current `single_token` is the last
-            one in sentence.
-        :param bool only_goal: only output trees with GOAL as root node
-        :param bool is_first: whether `single_token` is the first token
-        :return: (best parse tree, parse result)
-        :rtype: tuple(:class:`TreeNode`, :class:`ParseResult`) or (None, None)
+        Incremental parsing one token each time in the :attr:`session` of
+        the calling thread, see :func:`ParseSession.incremental_parse`.
         """
-        try:
-            if is_first:
-                self.clear_cache()
-            self.chart, parsed_tokens = self.incremental_parse_to_chart(
-                single_token, self.chart)
-            if len(parsed_tokens) > 0:
-                self.accepted_tokens.extend(parsed_tokens)
-            goal = self.goal if only_goal else None
-            trees = list(self.chart.trees(self.accepted_tokens,
-                                          all_trees=False, goal=goal))
-            tree, result = self.chart.best_tree_with_parse_result(trees)
-            if is_final:
-                self.accepted_tokens = []
-                self.chart = None
-            return tree, result
-        except ParseException:
-            if is_final:
-                self.accepted_tokens = []
-                self.chart = None
-            return None, None
+        return self.session.incremental_parse(single_token, is_final,
+                                              only_goal, is_first)
 
     def print_incremental_parse(self, sent):
         string = strip_string(sent)
         tokens = string.split()
+        session = self.new_session()
         chart = None
         accepted_tokens = []
         num = len(tokens)
         for i in xrange(num):
             token = tokens[i]
-            (chart, parsed_tokens) = self.incremental_parse_to_chart(
+            (chart, parsed_tokens) = session.incremental_parse_to_chart(
                 token, chart)
             if len(parsed_tokens) > 0:
                 accepted_tokens.extend(parsed_tokens)
@@ -2782,11 +4337,7 @@ class RobustParser(object):
             print("parsed tokens:", " ".join(accepted_tokens))
             print("parse tree so far:")
             try:
-                trees = list(chart.trees(accepted_tokens,
-                                         all_trees=False, goal=None))
-                best_tree, best_parse = chart.best_tree_with_parse_result(
-                    trees)
-                print(best_tree)
+                print(chart.best_tree(accepted_tokens))
             except ParseException:
                 pass
             print()
@@ -2811,34 +4362,11 @@ class RobustParser(object):
         if len(string) == 0:
             raise ParseException("input string is empty")
         tokens = string.split()
-        to_be_parsed = tokens[:]
-        all_parsed_tokens = []
-
-        chart, parsed_tokens = None, None
-        lex_start = 0
-
-        # "I want to turn off the lights please"
-        while True and len(to_be_parsed) > 0:
-            (chart, parsed_tokens) = self._parse_multi_token(
-                to_be_parsed, chart, lex_start)
-
-            # items in parsed_tokens could be multi-token: ["turn off"]
-            ret_len_in_single_tokens = sum([len(t.split())
-                                            for t in parsed_tokens])
-
-            if ret_len_in_single_tokens == 0:
-                # can't parse, skip the first token
-                to_be_parsed.pop(0)
-                lex_start += 1
-            elif ret_len_in_single_tokens == len(to_be_parsed):
-                all_parsed_tokens += parsed_tokens
-                break  # have a parse
-            else:  # partial parse
-                # pop out the token where the chart stopped at
-                # and try once again
-                all_parsed_tokens += parsed_tokens
-                to_be_parsed = to_be_parsed[ret_len_in_single_tokens + 1:]
-                lex_start += (ret_len_in_single_tokens + 1)
+
+        # "I want to turn off the lights please": unlicensed tokens are
+        # skipped within a single left-to-right pass over the chart
+        chart, all_parsed_tokens = self._parse_multi_token(
+            tokens, None, 0, skip=True)
 
         if not self.logger.disabled and chart:
             self.logger.debug("Chart:")
@@ -2862,7 +4390,8 @@ class RobustParser(object):
                                          phrase)
         return progressed
 
-    def _parse_multi_token(self, sent_or_tokens, chart=None, lex_start=None):
+    def _parse_multi_token(self, sent_or_tokens, chart=None, lex_start=None,
+                           skip=False):
         """
         Parse sentences while being able to tokenize multiple tokens,
         for instance:
@@ -2872,7 +4401,10 @@ class RobustParser(object):
 
         Each quotes-enclosed (multi-)token is recognized as a phrase.
 
-        This function doesn't parse unrecognizable tokens.
+        This function doesn't parse unrecognizable tokens: parsing stops at
+        the first of them, unless `skip` is True, in which case the token is
+        thrown away (still counted in lexical spans) and parsing goes on
+        with the next one.
         """
 
         if isinstance(sent_or_tokens, basestring):
@@ -2890,7 +4422,9 @@ class RobustParser(object):
         agenda = Agenda()
 
         if chart is None:
-            chart = IncrementalChart()
+            chart = self.chart_class(**self.chart_kwargs)
+            chart.debug = self.debug
+            chart.reserve(length)
         if chart.size == 0:
             chart.chart_i = 0
 
@@ -2898,25 +4432,36 @@ class RobustParser(object):
             chart.chart_i = chart.size - 1
 
         new_tokens = []
+        grammar = self.grammar
 
         # whether this word is covered in grammar
         progressed = False
         phrase_start = 0
         phrase_end = 0
+        # node of the current phrase in grammar.phrase_trie
+        node = None
+        num_words = 0
         while phrase_end < length:
 
             if progressed or phrase_end == 0:
                 chart.chart_i += 1
                 phrase_start = phrase_end
                 phrase_end += 1
+                node, num_words = grammar.phrase_trie, 0
             else:
                 # try a longer phrase by fixing phrase_start and increasing
                 # phrase_end
                 phrase_end += 1
 
-            phrase = " ".join(tokens[phrase_start: phrase_end])
-
-            progressed = self._parse_single_token(agenda, chart, phrase)
+            token = tokens[phrase_end - 1]
+            node = grammar.advance_phrase(node, token)
+            num_words += token.count(" ") + 1
+            if grammar.phrase_may_parse(node, num_words):
+                phrase = " ".join(tokens[phrase_start: phrase_end])
+                progressed = self._parse_single_token(agenda, chart, phrase)
+            else:
+                # known dead: no terminal parses this phrase
+                progressed = False
 
             if progressed:
                 new_tokens.append(phrase)
@@ -2924,6 +4469,17 @@ class RobustParser(object):
                     chart.set_lexical_span(lex_start,
                                            lex_start+phrase_end-phrase_start)
                     lex_start += phrase_end-phrase_start
+            elif phrase_end == length or \
+                    not grammar.phrase_may_grow(node, num_words):
+                if not skip:
+                    break
+                # no phrase starts from this token: skip it and start over
+                # from the next token at the same chart position
+                phrase_start += 1
+                phrase_end = phrase_start
+                node, num_words = grammar.phrase_trie, 0
+                if lex_start is not None:
+                    lex_start += 1
 
         if not self.logger.disabled:
             self.logger.debug("Agenda total: %d" % agenda.total)
@@ -2936,9 +4492,8 @@ class RobustParser(object):
         chart, tokens = self.parse_to_chart(string)
         self.chart = chart
         try:
-            trees = list(chart.trees(tokens, all_trees=False, goal=self.goal))
-            best_tree, best_parse = chart.best_tree_with_parse_result(trees)
-            return best_tree, best_parse
+            best_tree = chart.best_tree(tokens, goal=self.goal)
+            return best_tree, best_tree.to_parse_result()
         except ParseException:
             # print("can't parse:", string, file=sys.stderr)
             return None, None
@@ -2954,6 +4509,57 @@ class RobustParser(object):
         """
         return self.parse_string(string)
 
+    def parse_batch(self, sents, workers=None, chunksize=64):
+        """
+        Parse many sentences (e.g., logged utterances) with worker processes
+        forked from this one, which share the compiled grammar without
+        serializing it. Results are yielded in the order of `sents`. Only
+        a few chunks of `sents` are read ahead of the results consumed, thus
+        `sents` can be a long iterator.
+
+        Sentences are parsed in this process if `workers` is 1 or if the
+        platform can't fork.
+
+        :param sents: an iterable of sentences
+        :param int workers: number of worker processes, default to the
+            number of CPUs
+        :param int chunksize: number of sentences sent to a worker at a time
+        :return: a generator of ``(sentence, result, error)``, where
+            `result` is the :class:`ParseResult` as returned by
+            :func:`parse` (None if not parsed) and `error` the message of
+            the exception raised while parsing `sentence`, or None
+        :rtype: generator(tuple(str, :class:`ParseResult`, str))
+        """
+        workers = workers or multiprocessing.cpu_count()
+        pool = _fork_pool(workers, self) if workers > 1 else None
+        if pool is None:
+            for sent in sents:
+                yield (sent,) + _parse_batch_item(self, sent)
+            return
+
+        sents = iter(sents)
+        # (chunk, async result) in input order, bounded for back-pressure
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < 2 * workers:
+                    chunk = list(itertools.islice(sents, chunksize))
+                    if len(chunk) == 0:
+                        break
+                    pending.append((chunk, pool.apply_async(
+                        _parse_batch_chunk, (chunk,))))
+                if len(pending) == 0:
+                    break
+                chunk, async_result = pending.popleft()
+                for sent, (result, error) in zip(chunk, async_result.get()):
+                    if result is not None:
+                        result = pickle.loads(result)
+                    yield sent, result, error
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
     def print_parse(self, string, all_trees=False, only_goal=True,
                     best_parse=True, print_json=False,
                     strict_match=False):
@@ -3011,6 +4617,297 @@ class RobustParser(object):
             return True
 
 
+class ParseSession(object):
+    """
+    The state of parsing one utterance incrementally with a
+    :class:`RobustParser`: the chart so far, the tokens waiting to be
+    parsed and the accepted tokens. Sessions are cheap, and many of them can
+    parse with the same parser at the same time, but each session should be
+    used by one thread at a time.
+
+    :param RobustParser parser: the parser to parse with
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.clear()
+
+    def clear(self):
+        """
+        Clear all history to parse another sentence.
+        """
+        self.to_be_parsed = []
+        # number of pending tokens dropped from the head of to_be_parsed
+        self.to_be_parsed_offset = 0
+        self.accepted_tokens = []
+        self.chart = None
+
+    def incremental_parse_to_chart(self, single_token, chart):
+        """
+        Incremental parsing one token each time. Returns
+        (chart, is_token_accepted).
+
+        :param str single_token: a single word
+        :param RobustChart chart: the previous returned chart. On first call,
+                      set it to None.
+        :return: a tuple of (chart, parsed_tokens)
+        """
+        if chart is None:
+            self.to_be_parsed = []
+            self.to_be_parsed_offset = 0
+        self.to_be_parsed.append(single_token)
+        max_phrase = self.parser.grammar.max_phrase_tokens
+        if max_phrase is not None:
+            # no terminal parses a phrase longer than max_phrase tokens: only
+            # the pending tokens a new phrase can still start from are kept,
+            # so each new token does bounded work
+            start, num_words = len(self.to_be_parsed), 0
+            while start > 0:
+                num_words += len(self.to_be_parsed[start - 1].split())
+                if num_words > max_phrase:
+                    break
+                start -= 1
+            self.to_be_parsed_offset += start
+            del self.to_be_parsed[:start]
+        num = len(self.to_be_parsed)
+
+        # "please turn off"
+        # please -> no parse, save ["please"]
+        # please turn ->
+        # -> "please turn" no parse
+        #   -> "turn" no parse
+        #   -> save ["please turn"]
+        # please turn off ->
+        #   -> "please turn off" no parse, save it
+        #   -> "turn off" parse, return, save []
+        progress = 0
+        is_parsed = False
+        parsed_tokens = []
+        while progress < num and not is_parsed:
+            single_list = [" ".join(self.to_be_parsed[progress:])]
+            (chart, parsed_tokens) = self.parser._parse_multi_token(
+                single_list, chart, self.to_be_parsed_offset + progress)
+            is_parsed = len(parsed_tokens) > 0
+            if is_parsed:
+                self.to_be_parsed = []
+                self.to_be_parsed_offset = 0
+            progress += 1
+
+        return chart, parsed_tokens
+
+    def incremental_parse(self, single_token, is_final, only_goal=True,
+                          is_first=False):
+        """
+        Incremental parsing one token each time. Returns the best parsing tree
+        and parse result.
+
+        :param str single_token: a single word
+        :param bool is_final: whether the current `single_token` is the last
+            one in sentence.
+        :param bool only_goal: only output trees with GOAL as root node
+        :param bool is_first: whether `single_token` is the first token
+        :return: (best parse tree, parse result)
+        :rtype: tuple(:class:`TreeNode`, :class:`ParseResult`) or (None, None)
+        """
+        try:
+            if is_first:
+                self.clear()
+            self.chart, parsed_tokens = self.incremental_parse_to_chart(
+                single_token, self.chart)
+            if len(parsed_tokens) > 0:
+                self.accepted_tokens.extend(parsed_tokens)
+            goal = self.parser.goal if only_goal else None
+            tree = self.chart.best_tree(self.accepted_tokens, goal=goal)
+            result = tree.to_parse_result()
+            if is_final:
+                self.accepted_tokens = []
+                self.chart = None
+            return tree, result
+        except ParseException:
+            if is_final:
+                self.accepted_tokens = []
+                self.chart = None
+            return None, None
+
+
+class _AsyncResult(object):
+    """
+    Result of a call submitted to an :class:`AsyncParser`, with the
+    interface of :class:`multiprocessing.pool.AsyncResult`.
+    """
+
+    def __init__(self, callback=None):
+        self._event = threading.Event()
+        self._callback = callback
+        self._value = None
+        self._error = None
+
+    def _run(self, func, args):
+        try:
+            try:
+                self._value = func(*args)
+            except Exception as e:
+                self._error = e
+                return
+            if self._callback is not None:
+                try:
+                    self._callback(self._value)
+                except Exception:
+                    # the value stands, the callback is the caller's bug
+                    logging.getLogger(__name__).exception(
+                        "callback of an asynchronous parse failed")
+        finally:
+            self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def successful(self):
+        if not self.ready():
+            raise ValueError("result is not ready")
+        return self._error is None
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise multiprocessing.TimeoutError
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class AsyncParser(object):
+    """
+    A non-blocking front end of a :class:`RobustParser` for event driven
+    servers. Parsing runs on a bounded pool of threads sharing `parser`,
+    and calls return at once with a result object like
+    :class:`multiprocessing.pool.AsyncResult`: wait on it with ``get()``,
+    or pass a `callback` that is called with the value from a pool thread
+    (e.g., to hand it back to the event loop thread).
+
+    :param RobustParser parser: a parser, with its tables already built
+    :param int workers: number of threads
+    """
+
+    def __init__(self, parser, workers=4):
+        self.parser = parser
+        self._pool = ThreadPool(workers)
+        self._lock = threading.Lock()
+        self._closing = False
+
+    def _submit(self, func, args, callback=None):
+        result = _AsyncResult(callback)
+        self._pool.apply_async(result._run, (func, args))
+        return result
+
+    def _requeue(self, func):
+        """
+        Queue `func` on the pool, unless it is closing.
+
+        :return: whether `func` was queued
+        """
+        with self._lock:
+            if self._closing:
+                return False
+            self._pool.apply_async(func)
+            return True
+
+    def parse(self, string, callback=None):
+        """
+        Asynchronous :func:`RobustParser.parse`.
+
+        :return: the future (best tree, best parse)
+        """
+        return self._submit(self.parser.parse, (string,), callback)
+
+    def new_session(self):
+        """
+        Create a new session to incrementally parse an utterance.
+
+        :rtype: :class:`AsyncParseSession`
+        """
+        return AsyncParseSession(self)
+
+    def close(self):
+        """
+        Finish pending calls and stop the threads.
+        """
+        with self._lock:
+            # sessions now run their queued calls without requeueing
+            self._closing = True
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncParseSession(object):
+    """
+    Asynchronous :class:`ParseSession` of an :class:`AsyncParser`. Calls
+    of a session run one at a time in the order they were made, while
+    sessions take turns on the threads of the parser: a long utterance
+    doesn't hold up the others.
+
+    :param AsyncParser async_parser: the parser to parse with
+    """
+
+    def __init__(self, async_parser):
+        self.async_parser = async_parser
+        self.session = async_parser.parser.new_session()
+        self._lock = threading.Lock()
+        # calls waiting to run, as (function, args, result)
+        self._pending = deque()
+        self._running = False
+
+    def _submit(self, func, args, callback=None):
+        result = _AsyncResult(callback)
+        with self._lock:
+            self._pending.append((func, args, result))
+            if self._running:
+                return result
+            self._running = True
+        self.async_parser._pool.apply_async(self._step)
+        return result
+
+    def _step(self):
+        while True:
+            with self._lock:
+                func, args, result = self._pending.popleft()
+            result._run(func, args)
+            with self._lock:
+                if len(self._pending) == 0:
+                    self._running = False
+                    return
+            # back of the queue, so that other sessions get their turn,
+            # or finish the calls here once the pool is closing
+            if self.async_parser._requeue(self._step):
+                return
+
+    def incremental_parse(self, single_token, is_final, only_goal=True,
+                          is_first=False, callback=None):
+        """
+        Asynchronous :func:`ParseSession.incremental_parse`.
+
+        :return: the future (best parse tree, parse result)
+        """
+        return self._submit(self.session.incremental_parse,
+                            (single_token, is_final, only_goal, is_first),
+                            callback)
+
+    def clear(self):
+        """
+        Asynchronous :func:`ParseSession.clear`, after pending calls.
+        """
+        return self._submit(self.session.clear, ())
+
+
 def strip_string(string):
     """
     Merge spaces into single space
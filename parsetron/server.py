@@ -0,0 +1,233 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import sys
+import json
+import time
+import argparse
+import importlib
+import threading
+from collections import OrderedDict
+try:
+    from SocketServer import StreamRequestHandler, ThreadingUnixStreamServer
+except ImportError:
+    from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+
+from parsetron.parsetron import RobustParser, IncrementalChart, \
+    SparseIncrementalChart, ParseResult
+
+__doc__ = \
+    """
+    A multi-session incremental parsing server speaking JSON lines, e.g.::
+
+        python -m parsetron.server \\
+            parsetron.grammars.colored_light:ColoredLightGrammar
+
+    reads one request per line from stdin and writes one response per line
+    to stdout, or serves a Unix socket with ``--socket PATH``. Requests are
+    JSON objects:
+
+    - ``{"session": "mic-1", "token": "turn"}`` parses the next token of the
+      utterance of session ``mic-1``, add ``"final": true`` to the last
+      token of an utterance (and ``"first": true`` to restart one);
+    - ``{"session": "mic-1", "close": true}`` forgets session ``mic-1``;
+    - ``{"text": "turn off the lights"}`` parses a whole sentence.
+
+    Responses are JSON objects with the ``result`` of parsing (null when
+    there is no parse yet), the ``session`` and the ``id`` of the request
+    if given, or an ``error`` message.
+
+    Each session keeps its :class:`parsetron.ParseSession` (thus its chart
+    so far) in memory. The least recently used sessions are evicted beyond
+    ``--max-sessions``, and idle ones after ``--idle-timeout`` seconds.
+    A token of an evicted or expired session is answered with
+    ``"expired": true`` instead of a result, until the client restarts the
+    utterance with ``"first": true``.
+    """
+
+
+class SessionExpired(Exception):
+    """
+    The session was evicted or expired in the middle of an utterance.
+    """
+    pass
+
+
+class _Entry(object):
+    __slots__ = ["session", "lock", "last_use"]
+
+    def __init__(self, session):
+        self.session = session
+        # a session parses one token at a time
+        self.lock = threading.Lock()
+        self.last_use = None
+
+
+class SessionStore(object):
+    """
+    Parse sessions of a :class:`parsetron.RobustParser` keyed by session
+    ids, created on first use. Sessions are kept in least recently used
+    order: the oldest ones are evicted when there are more than
+    `max_sessions`, and sessions unused for `idle_timeout` seconds expire.
+    An evicted or expired session is only created again by the first
+    token of an utterance.
+
+    :param RobustParser parser: the parser shared by all sessions
+    :param int max_sessions: maximal number of sessions kept
+    :param float idle_timeout: seconds before an unused session expires
+    :param clock: a function returning the current time in seconds
+    """
+
+    def __init__(self, parser, max_sessions=10000, idle_timeout=300.0,
+                 clock=time.time):
+        self.parser = parser
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        # session id -> _Entry, least recently used first
+        self._sessions = OrderedDict()
+        # ids of the sessions evicted or expired, oldest first
+        self._dropped = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def _get(self, session_id, is_first):
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                if session_id in self._dropped and not is_first:
+                    raise SessionExpired(session_id)
+                self._dropped.pop(session_id, None)
+                entry = _Entry(self.parser.new_session())
+            entry.last_use = now
+            self._sessions[session_id] = entry
+            while len(self._sessions) > self.max_sessions:
+                self._drop(self._sessions.popitem(last=False)[0])
+            return entry
+
+    def _expire(self, now):
+        while self._sessions:
+            entry = next(iter(self._sessions.values()))
+            if now - entry.last_use < self.idle_timeout:
+                break
+            self._drop(self._sessions.popitem(last=False)[0])
+
+    def _drop(self, session_id):
+        self._dropped[session_id] = True
+        # remember as many dropped ids as sessions
+        while len(self._dropped) > self.max_sessions:
+            self._dropped.popitem(last=False)
+
+    def incremental_parse(self, session_id, single_token, is_final,
+                          is_first=False):
+        """
+        :func:`parsetron.ParseSession.incremental_parse` with session
+        `session_id`.
+
+        :return: (best parse tree, parse result)
+        :raise SessionExpired: if the session was evicted or expired and
+            `is_first` is False
+        """
+        entry = self._get(session_id, is_first)
+        with entry.lock:
+            return entry.session.incremental_parse(single_token, is_final,
+                                                   is_first=is_first)
+
+    def close(self, session_id):
+        """
+        Forget session `session_id`.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+def handle_request(store, line):
+    """
+    Handle one request line of the protocol.
+
+    :param SessionStore store: sessions to parse with
+    :param str line: a JSON request
+    :return: a JSON response
+    :rtype: str
+    """
+    response = {}
+    try:
+        request = json.loads(line)
+        if "id" in request:
+            response["id"] = request["id"]
+        if "text" in request:
+            response["result"] = store.parser.parse(request["text"])[1]
+        else:
+            session_id = request["session"]
+            response["session"] = session_id
+            if request.get("close"):
+                store.close(session_id)
+                response["closed"] = True
+            else:
+                response["result"] = store.incremental_parse(
+                    session_id, request["token"],
+                    bool(request.get("final")), bool(request.get("first")))[1]
+    except SessionExpired:
+        response["expired"] = True
+    except Exception as e:
+        response.pop("result", None)
+        response["error"] = "%s: %s" % (e.__class__.__name__, e)
+    return json.dumps(response, default=ParseResult._serialize)
+
+
+def serve(store, infile, outfile):
+    """
+    Answer the request lines of `infile` to `outfile` until end of file.
+    """
+    for line in iter(infile.readline, ""):
+        if line.strip():
+            outfile.write(handle_request(store, line) + "\n")
+            outfile.flush()
+
+
+def serve_socket(store, path):
+    """
+    Serve the connections to the Unix socket `path`, each in a thread.
+    """
+    class Handler(StreamRequestHandler):
+        def handle(self):
+            serve(store, self.rfile, self.wfile)
+
+    server = ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description="Multi-session incremental parsing server")
+    arg_parser.add_argument("grammar",
+                            help="grammar class, as module:GrammarClass")
+    arg_parser.add_argument("--socket",
+                            help="serve this Unix socket, not stdin/stdout")
+    arg_parser.add_argument("--max-sessions", type=int, default=10000)
+    arg_parser.add_argument("--idle-timeout", type=float, default=300.0,
+                            help="seconds before an idle session expires")
+    arg_parser.add_argument("--sparse", action="store_true",
+                            help="parse into SparseIncrementalChart")
+    args = arg_parser.parse_args(argv)
+
+    module, _, name = args.grammar.partition(":")
+    grammar = getattr(importlib.import_module(module), name)()
+    chart_class = SparseIncrementalChart if args.sparse else IncrementalChart
+    store = SessionStore(RobustParser(grammar, chart_class=chart_class),
+                         args.max_sessions, args.idle_timeout)
+    if args.socket:
+        serve_socket(store, args.socket)
+    else:
+        serve(store, sys.stdin, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 from parsetron import *  # NOQA
+import os
 import re
+import sys
+import subprocess
 import pytest
 
 __author__ = 'Xuchen Yao'
@@ -155,6 +158,23 @@ class TestString(object):
         with pytest.raises(ParseException):
             s.parse("hell")
 
+    def test_match(self):
+        s = StringCs("hello")
+        assert s.match("hello")
+        assert not s.match("Hello")
+        assert not s.match("")
+        assert String("hello").match("Hello")
+        assert not String("hello").match("hell")
+        assert not NULL.match("hello")
+
+        class Custom(GrammarElement):
+            def _parse(self, instring):
+                if instring != "x":
+                    raise ParseException
+                return True
+        assert Custom().match("x")
+        assert not Custom().match("y")
+
 
 class TestRegex(object):
     def test_empty_init(self):
@@ -186,6 +206,15 @@ class TestRegex(object):
         r3 = Regex("ab", match_whole=False)
         r3.parse("abc")
 
+    def test_match(self):
+        r = Regex(r"(ab|bc)")
+        assert r.match("AB")
+        assert not r.match("abc")
+        assert not RegexCs(r"(ab|bc)").match("AB")
+        assert Regex("ab", match_whole=False).match("abc")
+        assert Set("a b").match("A")
+        assert not SetCs("a b").match("A")
+
 
 class TestSet(object):
     def test_parse(self):
@@ -309,6 +338,502 @@ class TestGrammar(object):
         with pytest.raises(NotImplementedError):
             TestGrammar.LightGrammar.test()
 
+    def test_grammar_cache(self, tmpdir):
+        def define(word):
+            class CachedGrammar(Grammar):
+                light = String(word)
+                times = Regex(r"(once|twice)").set_result_action(
+                    lambda r: r.set(r.get().upper()))
+                GOAL = OneOrMore(light) + Optional(times)
+            CachedGrammar()
+            return CachedGrammar
+
+        set_grammar_cache(str(tmpdir))
+        try:
+            compiled = define("light")
+            assert 1 == len(tmpdir.listdir())
+            loaded = define("light")
+            assert 1 == len(tmpdir.listdir())
+            g = loaded()
+            assert g.terminal2prod[loaded.light].lhs is loaded.light
+            assert g._lc_cats
+            sent = "light light twice"
+            assert str(RobustParser(compiled()).parse(sent)[1]) == \
+                str(RobustParser(g).parse(sent)[1])
+            # changing the grammar invalidates its cache
+            define("lamp")
+            assert 2 == len(tmpdir.listdir())
+            # so does a corrupt cache file
+            for f in tmpdir.listdir():
+                f.write("garbage")
+            g = define("light")()
+            assert RobustParser(g).parse(sent)[0] is not None
+        finally:
+            set_grammar_cache(None)
+
+    def test_grammar_cache_hash_seed(self, tmpdir):
+        # the cache key of a grammar with sets doesn't depend on the hash
+        # seed of the process
+        script = "\n".join([
+            "from parsetron import *",
+            "set_grammar_cache(%r)" % str(tmpdir),
+            "class SeedGrammar(Grammar):",
+            "    color = Set('red green blue yellow purple orange white')",
+            "    GOAL = OneOrMore(color) + String('light')",
+            "SeedGrammar()"])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for seed in ("1", "2"):
+            env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=root)
+            subprocess.check_call([sys.executable, "-c", script], env=env)
+        assert 1 == len(tmpdir.listdir())
+
+    def test_grammar_cache_unstable_field(self, tmpdir):
+        class Opaque(object):
+            pass
+
+        set_grammar_cache(str(tmpdir))
+        try:
+            class OpaqueGrammar(Grammar):
+                light = String("light")
+                light.opaque = Opaque()
+                GOAL = OneOrMore(light)
+            # compiled, but not cached under a repr() of an arbitrary object
+            assert RobustParser(OpaqueGrammar()).parse("light")[0]
+            assert 0 == len(tmpdir.listdir())
+        finally:
+            set_grammar_cache(None)
+
+    def test_lazy_grammars(self):
+        def define():
+            class Shared(Grammar):
+                light = String("light")
+                GOAL = OneOrMore(light)
+
+            class Unused(Grammar):
+                GOAL = String("unused")
+
+            class User(Grammar):
+                lights = Shared.GOAL
+                GOAL = lights + Optional(String("on"))
+            return Shared, Unused, User
+
+        Shared, Unused, User = define()
+        set_lazy_grammars(True)
+        try:
+            LazyShared, LazyUnused, LazyUser = define()
+        finally:
+            set_lazy_grammars(False)
+        assert LazyUser.__dict__['_grammar_'] is None
+        lazy = LazyUser()
+        assert lazy is LazyUser()
+        # shared elements are compiled in definition order, as eagerly
+        assert LazyShared.__dict__['_grammar_'] is not None
+        assert LazyUnused.__dict__['_grammar_'] is None
+        assert LazyShared.GOAL.variable_name == Shared.GOAL.variable_name
+        sent = "light light on"
+        assert str(RobustParser(User()).parse(sent)[1]) == \
+            str(RobustParser(lazy).parse(sent)[1])
+
+    def test_validate_productions(self):
+        light = String("light")
+        Production.factory(light).validate()
+        with pytest.raises(GrammarException):
+            Production(light, (light,)).validate()
+        with pytest.raises(GrammarException):
+            Production(light, [light, "light"]).validate()
+        with pytest.raises(GrammarException):
+            ElementEnhanceProduction(light, [light]).validate()
+
+
+class TestScanTerminals(object):
+    class ScanGrammar(Grammar):
+        cs = StringCs("Hue")
+        ci = String("Light")
+        cs_set = SetCs(["Top", "bottom"])
+        ci_set = Set(["top", "living room"])
+        digits = Regex(r"\d+")
+        GOAL = OneOrMore(cs | ci | cs_set | ci_set | digits)
+
+    def scanned(self, lexicon):
+        g = TestScanTerminals.ScanGrammar()
+        return set(str(p.lhs) for p in g.filter_terminals_for_scan(lexicon))
+
+    def test_filter_terminals_for_scan(self):
+        assert self.scanned("Hue") == {"cs"}
+        assert self.scanned("hue") == set()
+        assert self.scanned("LIGHT") == {"ci"}
+        assert self.scanned("Top") == {"cs_set", "ci_set"}
+        assert self.scanned("top") == {"ci_set"}
+        assert self.scanned("Living Room") == {"ci_set"}
+        assert self.scanned("42") == {"digits"}
+        assert self.scanned("bottom light") == set()
+
+    def test_filter_productions_for_prediction(self):
+        g = TestScanTerminals.ScanGrammar()
+        goal = TestScanTerminals.ScanGrammar.GOAL
+        for prod in g.productions:
+            assert prod in g.filter_productions_for_prediction_by_lhs(
+                prod.lhs)
+            assert prod in g.filter_productions_for_prediction_by_rhs(
+                prod.rhs[0])
+        assert all(p.lhs is goal
+                   for p in g.filter_productions_for_prediction_by_lhs(goal))
+        assert () == g.filter_productions_for_prediction_by_lhs(String("x"))
+
+    def test_max_tokens(self):
+        assert 2 == Set(["top", "living room"]).max_tokens()
+        assert 1 == Regex(r"\d+").max_tokens()
+        assert 1 == Regex(r"[^ ]+").max_tokens()
+        assert Regex(r"\d+", match_whole=False).max_tokens() is None
+        assert Regex(r"[a-z ]+").max_tokens() is None
+        assert Regex(r".*").max_tokens() is None
+        assert 2 == Regex(r"\w+\s\w+").max_tokens()
+        assert 3 == Regex(r"(turn off|turn (the )?light)").max_tokens()
+        assert 2 == TestScanTerminals.ScanGrammar().max_phrase_tokens
+
+        class AnyGrammar(Grammar):
+            GOAL = OneOrMore(Regex(r"(\w+ )+\w+") | String("x"))
+        assert AnyGrammar().max_phrase_tokens is None
+
+    def test_phrase_trie(self):
+        g = TestScanTerminals.ScanGrammar()
+        root = g.phrase_trie
+        living = g.advance_phrase(root, "Living")
+        living_room = g.advance_phrase(living, "room")
+        assert living_room is g.advance_phrase(root, "living room")
+        assert g.advance_phrase(root, "um") is None
+        assert g.advance_phrase(None, "room") is None
+
+        # "living" may only grow into "living room"
+        assert g.phrase_may_grow(living, 1)
+        assert g.phrase_may_parse(living_room, 2)
+        assert not g.phrase_may_grow(living_room, 2)
+        # only digits parse unknown single tokens
+        assert g.phrase_may_parse(None, 1)
+        assert not g.phrase_may_parse(None, 2)
+        assert not g.phrase_may_grow(None, 1)
+
+
+class TestLeftCorner(object):
+    class LCGrammar(Grammar):
+        c = String("c")
+        e = String("e")
+        b = String("b")
+        C = c + b
+        A = C + b | e + b
+        GOAL = A + b
+
+    def test_left_corner_table(self):
+        g = TestLeftCorner.LCGrammar()
+        RobustParser(g, strategy=LeftCornerStrategy)
+        G = TestLeftCorner.LCGrammar
+        goal_prod = list(g.goal_productions)[0]
+        c_term, e_term, b_term = [g.terminal2prod[t] for t in (G.c, G.e, G.b)]
+        assert {c_term, e_term} == g.get_left_corner_terminals(goal_prod)
+        assert {c_term} == g.get_left_corner_terminals(
+            list(g.nonterminal2prod[G.C])[0])
+        lc_lhs = set(p.lhs for p in
+                     g.get_left_corner_nonterminals(goal_prod))
+        assert {G.GOAL, G.A, G.C} <= lc_lhs and G.b not in lc_lhs
+        assert g.production_mask(g.get_left_corner_terminals(goal_prod)) == \
+            g.get_left_corner_terminal_mask(goal_prod)
+        predicted = g.get_left_corner_predictions(goal_prod, c_term)
+        assert c_term in g.get_left_corner_terminals(predicted[0])
+        assert all(c_term in g.get_left_corner_terminals(p)
+                   for p in predicted)
+        assert [] == g.get_left_corner_predictions(goal_prod, b_term)
+        assert [g.terminal2prod[NULL]] == g.productions_of(1)
+        assert g.scan_terminal_mask("E") == g.production_mask([e_term])
+
+
+class TestMultiRegex(object):
+    def matched(self, regex, lexicon):
+        return set(str(p.lhs) for p in regex.match(lexicon))
+
+    def test_match(self):
+        elements = [Regex(r"\d+")("digits"),
+                    RegexCs(r"(on|off)")("on_off"),
+                    Regex(r"(o|of)", match_whole=False)("prefix"),
+                    Regex(r"(?P<unit>cm|mm)")("unit"),
+                    Regex(r"(a)\1")("aa"),
+                    Regex(r"(a)?(?(1)b|c)")("cond")]
+        regex = MultiRegex([e.production() for e in elements])
+        assert len(regex.fallback) == 3
+        assert self.matched(regex, "42") == {"digits"}
+        assert self.matched(regex, "on") == {"on_off", "prefix"}
+        assert self.matched(regex, "ON") == {"prefix"}
+        assert self.matched(regex, "offset") == {"prefix"}
+        assert self.matched(regex, "MM") == {"unit"}
+        assert self.matched(regex, "aa") == {"aa"}
+        assert self.matched(regex, "ab") == self.matched(regex, "c") == \
+            {"cond"}
+        assert self.matched(regex, "4 2") == set()
+
+    def test_many_groups(self):
+        elements = [Regex(r"(n)(%d)" % i)("r%d" % i) for i in range(100)]
+        regex = MultiRegex([e.production() for e in elements])
+        assert len(regex.regexes) > 1
+        assert self.matched(regex, "n42") == {"r42"}
+
+
+class TestChart(object):
+    class NPGrammar(Grammar):
+        nns = String("men")
+        cc = String("and")
+        np = nns + cc + nns
+        GOAL = np
+
+    class AmbiguousGrammar(Grammar):
+        word = String("men")
+        opt = Optional(word)
+        words = OneOrMore(word | opt)
+        GOAL = words + Optional(String("and")) + words
+
+    def test_filter_edges(self):
+        g = TestChart.NPGrammar()
+        nns, np = TestChart.NPGrammar.nns, TestChart.NPGrammar.np
+        np_prod = g.nonterminal2prod[np].pop()
+        nns_prod = g.terminal2prod[nns]
+        chart = Chart(4)
+        predicted = Edge(1, 1, np_prod, 0)
+        scanned = Edge(1, 2, nns_prod, 1)
+        assert chart.add_edge(predicted, None, None)
+        assert chart.add_edge(scanned, None, None)
+        assert not chart.add_edge(Edge(1, 2, nns_prod, 1), None, None)
+        assert [predicted] == chart.filter_edges_for_completion(1, nns)
+        assert [] == chart.filter_edges_for_completion(1, np)
+        assert [] == chart.filter_edges_for_completion(2, nns)
+        assert [scanned] == chart.filter_completed_edges(1, nns)
+        assert [] == chart.filter_completed_edges(1, np)
+        assert [] == chart.filter_completed_edges(2, nns)
+
+    def test_production_ids(self):
+        g = TestChart.NPGrammar()
+        ids = sorted(p.id for p in g.productions)
+        assert list(range(len(g.productions))) == ids
+        assert 0 == g.terminal2prod[NULL].id
+        nns = TestChart.NPGrammar.nns
+        nns_prod = g.terminal2prod[nns]
+        # structurally equal productions are equal, whatever their ids
+        twin = Production.factory(nns)
+        assert twin.id < 0 and twin.id != Production.factory(nns).id
+        assert twin == nns_prod and hash(twin) == hash(nns_prod)
+        assert twin != Production.factory(TestChart.NPGrammar.cc)
+        assert Edge(0, 1, nns_prod, 1) == Edge(0, 1, nns_prod, 1)
+        assert Edge(0, 1, nns_prod, 1) != Edge(0, 1, nns_prod, 0)
+        assert Edge(0, 1, nns_prod, 1) != Edge(0, 1, twin, 1)
+        assert Edge(0, 1, nns_prod, 1) != (0, 1, nns_prod.id, 1)
+
+    def test_sparse_chart(self):
+        g = TestChart.NPGrammar()
+        dense = RobustParser(g)
+        sparse = RobustParser(g, chart_class=SparseIncrementalChart)
+        sent = "um men uh and men"
+        chart, tokens = dense.parse_to_chart(sent)
+        sparse_chart, sparse_tokens = sparse.parse_to_chart(sent)
+        assert tokens == sparse_tokens
+        assert str(chart) == str(sparse_chart)
+        assert chart.get_lexical_span(0, 3) == \
+            sparse_chart.get_lexical_span(0, 3) == (1, 5)
+        assert chart.get_edges(0, 3) == sparse_chart.get_edges(0, 3)
+        assert 0 == len(sparse_chart.get_edges(3, 0))
+        assert len(sparse_chart._cells) < sparse_chart.size ** 2
+        assert str(dense.parse(sent)[0]) == str(sparse.parse(sent)[0])
+
+    def test_add_new_edge(self):
+        g = TestChart.NPGrammar()
+        nns_prod = g.terminal2prod[TestChart.NPGrammar.nns]
+        for c in (IncrementalChart(), SparseIncrementalChart()):
+            c.chart_i = 1
+            edge = c.add_new_edge(0, 1, nns_prod, 1, lexicon="men")
+            assert edge == Edge(0, 1, nns_prod, 1)
+            assert edge is c.find_edge(0, 1, nns_prod, 1)
+            assert {edge} == set(c.get_edges(0, 1))
+            # duplicates are found by key and never inserted twice
+            assert c.add_new_edge(0, 1, nns_prod, 1) is None
+            assert 1 == len(list(c.iter_edges()))
+            assert c.find_edge(1, 0, nns_prod, 1) is None
+
+    def test_debug(self):
+        g = TestChart.NPGrammar()
+        sent = "um men uh and men"
+        parser = RobustParser(g, debug=True)
+        chart, _ = parser.parse_to_chart(sent)
+        assert chart.debug and not IncrementalChart.debug
+        assert str(RobustParser(g).parse(sent)[0]) == \
+            str(parser.parse(sent)[0])
+        nns_prod = g.terminal2prod[TestChart.NPGrammar.nns]
+        # edges are not validated unless in debug mode
+        bad = Edge(2, 1, nns_prod, 1)
+        chart = IncrementalChart()
+        chart.add_edge(bad, None, None)
+        chart.debug = True
+        with pytest.raises(AssertionError):
+            chart.add_edge(bad, None, None)
+        with pytest.raises(AssertionError):
+            chart.add_edge(Edge(0, 1, nns_prod, 2), None, None)
+
+    def test_scan_terminals(self):
+        g = TestChart.NPGrammar()
+        nns_prod = g.terminal2prod[TestChart.NPGrammar.nns]
+        chart = IncrementalChart()
+        chart.chart_i = 1
+        scanned = chart.scan_terminals(g, "men")
+        assert ([nns_prod], g.production_mask([nns_prod])) == scanned
+        assert scanned is chart.scan_terminals(g, "men")
+        assert ([], 0) == chart.scan_terminals(g, "um")
+        chart.chart_i = 2
+        assert scanned is not chart.scan_terminals(g, "men")
+        assert scanned == chart.scan_terminals(g, "men")
+        for strategy in (TopDownStrategy, BottomUpStrategy,
+                         LeftCornerStrategy):
+            parser = RobustParser(g, strategy=strategy)
+            _, result = parser.parse("men um and men")
+            assert (0, 4) == result.lex_span()
+
+    def test_skip(self):
+        g = TestChart.NPGrammar()
+        parser = RobustParser(g)
+        chart, tokens = parser.parse_multi_token_skip_reuse_chart(
+            "um men um um and um uh men um")
+        assert ["men", "and", "men"] == tokens
+        assert (1, 8) == chart.get_lexical_span(0, 3)
+        assert (4, 5) == chart.get_lexical_span(1, 2)
+        _, result = parser.parse("men um um and um uh men um")
+        assert (0, 7) == result.lex_span()
+
+    def test_incremental_chart_growth(self):
+        g = TestChart.NPGrammar()
+        prod = g.terminal2prod[TestChart.NPGrammar.nns]
+        chart = IncrementalChart(init_size=2, inc_size=1, growth_factor=2)
+        sizes = set()
+        for i in range(100):
+            chart.add_edge(Edge(i, i + 1, prod, 1), None, None)
+            sizes.add(chart.max_size)
+        assert chart.size == 101
+        assert len(sizes) < 10
+        assert len(chart.edges) == len(chart.edges[0]) == chart.max_size
+        assert len(chart.lex_idx) == chart.max_size
+
+        chart = IncrementalChart()
+        chart.reserve(50)
+        max_size = chart.max_size
+        for i in range(50):
+            chart.add_edge(Edge(i, i + 1, prod, 1), None, None)
+        assert max_size == chart.max_size
+
+        chart = SparseIncrementalChart()
+        chart.reserve(50)
+        assert len(chart.lex_idx) >= 51
+
+    def test_parser_chart_growth(self):
+        def stream(**chart_kwargs):
+            parser = RobustParser(TestChart.AmbiguousGrammar(),
+                                  chart_kwargs=chart_kwargs)
+            session = parser.new_session()
+            sizes = set()
+            for i in range(60):
+                session.incremental_parse("men", False)
+                sizes.add(session.chart.max_size)
+            assert session.chart.size > 60
+            return sizes
+
+        assert len(stream(init_size=2, inc_size=1)) > 50
+        assert len(stream(init_size=2, inc_size=1, growth_factor=2)) < 8
+
+    def test_sparse_chart_interface(self):
+        # SparseIncrementalChart takes the arguments and has the fields of
+        # IncrementalChart
+        charts = []
+        for cls in (IncrementalChart, SparseIncrementalChart):
+            parser = RobustParser(TestChart.AmbiguousGrammar(),
+                                  chart_class=cls, chart_kwargs=dict(
+                                      init_size=2, inc_size=1,
+                                      growth_factor=2))
+            chart, _ = parser.parse_to_chart("men men and men")
+            assert len(chart.edges) == len(chart.edges[0]) == chart.max_size
+            chart.increase_capacity(20)
+            assert chart.max_size >= 20
+            charts.append(chart)
+        dense, sparse = [[[set(chart.edges[i][j]) for j in range(6)]
+                          for i in range(6)] for chart in charts]
+        assert dense == sparse
+        assert sparse[0][1] == charts[1].get_edges(0, 1)
+
+    def test_best_tree(self):
+        g = TestChart.AmbiguousGrammar()
+        parser = RobustParser(g)
+        chart, tokens = parser.parse_to_chart("men men and men men men")
+        trees = list(chart.trees(tokens, all_trees=False, goal=parser.goal))
+        best_tree, best_result = chart.best_tree_with_parse_result(trees)
+        tree = chart.best_tree(tokens, goal=parser.goal)
+        assert tree.size() == best_tree.size()
+        assert tree.size() == min(t.size() for _, t in trees)
+        assert tree.to_parse_result().lex_span() == best_result.lex_span()
+        with pytest.raises(ParseException):
+            chart.best_tree(tokens, goal=TestChart.AmbiguousGrammar.word)
+
+    def test_parse_forest(self):
+        g = TestChart.AmbiguousGrammar()
+        parser = RobustParser(g)
+        forest = parser.parse_to_forest("men men and men men")
+        trees = [t for _, t in forest.trees(all_trees=True)]
+        assert forest.count() == len(trees) > 1
+        assert forest.count(forest.roots[0]) == \
+            len(list(forest.kbest(len(trees))))
+        for edge in forest.edge2backpointers:
+            assert forest.children(edge)
+        best_tree, best_result = forest.best_parse()
+        assert best_tree.size() == min(t.size() for t in trees)
+        assert best_result.lex_span() == (0, 5)
+
+        # keep Optional words out of the parse
+        def has_opt(tree):
+            return tree.parent.prod.lhs is TestChart.AmbiguousGrammar.opt or \
+                any(has_opt(c) for c in tree.children)
+        pruned = forest.prune(lambda e: e.prod.lhs is not
+                              TestChart.AmbiguousGrammar.opt)
+        assert 0 < pruned.count() < forest.count()
+        assert pruned.count() == len([t for t in trees if not has_opt(t)])
+        assert not any(has_opt(t) for _, t in pruned.trees(all_trees=True))
+        # prune everything
+        pruned = forest.prune(lambda e: False)
+        assert 0 == pruned.count()
+        with pytest.raises(ParseException):
+            pruned.best_tree()
+
+    def test_tree_memo(self):
+        g = TestChart.NPGrammar()
+        parser = RobustParser(g)
+        chart, tokens = parser.parse_to_chart("men and men")
+        forest = chart.forest(tokens, goal=parser.goal)
+        root = forest.roots[0]
+        trees = forest._trees(root)
+        assert trees is forest._trees(root)
+        assert root in forest._all_tree_memo
+        assert len(forest._all_tree_memo) > 1
+        assert [str(t) for t in trees] == \
+            [str(t) for t in chart.forest(tokens)._trees(root)]
+
+    def test_kbest(self):
+        g = TestChart.AmbiguousGrammar()
+        parser = RobustParser(g)
+        chart, tokens = parser.parse_to_chart("men men and men men")
+        sizes = sorted(t.size() for _, t in
+                       chart.trees(tokens, all_trees=True, goal=parser.goal))
+        kbest = list(chart.kbest(len(sizes) + 1, tokens, goal=parser.goal))
+        assert sizes == [score for score, _ in kbest]
+        assert sizes == [t.size() for _, t in kbest]
+        assert len(sizes) == len(set(str(t) for _, t in kbest))
+        assert sizes[:3] == [s for s, _ in
+                             chart.kbest(3, tokens, goal=parser.goal)]
+
+        def num_children(edge, children, child_scores):
+            return len(children) + sum(child_scores)
+        scores = [s for s, _ in chart.kbest(5, goal=parser.goal,
+                                            score=num_children)]
+        assert scores == sorted(scores)
+
 
 class TestZeroOrMore(object):
     def test_or(self):
@@ -395,6 +920,133 @@ class TestParser(object):
         assert (None, None) == parser.incremental_parse('light', is_final=True)
         parser.clear_cache()
 
+    def test_incremental_parse_pending_tokens(self):
+        parser = TestParser.parser
+        max_phrase = parser.grammar.max_phrase_tokens
+        fillers = "um uh er hm".split() * 5
+        for i, token in enumerate(fillers):
+            t, r = parser.incremental_parse(token, False, is_first=(i == 0))
+            assert t is None
+            assert len(parser.to_be_parsed) <= max_phrase
+        assert parser.to_be_parsed_offset > 0
+        parser.incremental_parse('blink', False)
+        parser.incremental_parse('light', False)
+        t, r = parser.incremental_parse('quickly', is_final=True)
+        assert 'quickly' == r.quick
+        assert [] == parser.to_be_parsed
+        parser.clear_cache()
+        assert 0 == parser.to_be_parsed_offset
+
+    def test_sessions(self):
+        import threading
+        parser = TestParser.parser
+        a, b = parser.new_session(), parser.new_session()
+        # interleaved utterances don't see each other
+        assert (None, None) == a.incremental_parse('blink', False)
+        assert (None, None) == b.incremental_parse('turn off', False)
+        a.incremental_parse('light', False)
+        b.incremental_parse('red', False)
+        b.incremental_parse('light', False)
+        _, ra = a.incremental_parse('quickly', True)
+        _, rb = b.incremental_parse('quickly', True)
+        assert 'blink' == ra.action and 'turn off' == rb.action
+        assert a.chart is None and [] == a.accepted_tokens
+
+        # the default session of parser is per thread
+        parser.incremental_parse('blink', False, is_first=True)
+        sents = ["blink light twice quickly", "turn on red light quickly",
+                 "off light once once quickly"] * 4
+        expected = [str(parser.parse(sent)[1]) for sent in sents]
+        results = [None] * len(sents)
+
+        def work(i):
+            results[i] = str(parser.parse(sents[i])[1])
+            assert parser.chart is not None
+            parser.clear_cache()
+
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(len(sents))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert expected == results
+        assert ['blink'] == parser.accepted_tokens
+        parser.clear_cache()
+
+    def test_parse_batch(self):
+        import json
+        import pickle
+        parser = TestParser.parser
+        _, r = parser.parse(TestParser.test_str)
+        assert json.loads(str(r)) == \
+            json.loads(str(pickle.loads(pickle.dumps(r, 2))))
+
+        sents = ["blink light twice quickly", "", "can't parse",
+                 "turn on red light quickly"] * 3
+
+        def expect(sent):
+            try:
+                r = parser.parse(sent)[1]
+                return sent, r and json.loads(str(r)), None
+            except ParseException as e:
+                return sent, None, "ParseException: %s" % e
+
+        expected = [expect(sent) for sent in sents]
+        for workers in (1, 2):
+            batch = parser.parse_batch(iter(sents), workers, chunksize=3)
+            assert expected == [(sent, r and json.loads(str(r)), error)
+                                for sent, r, error in batch]
+
+    def test_async_parser(self):
+        parser = TestParser.parser
+        sent = TestParser.test_str
+        _, expected = parser.parse(sent)
+        with AsyncParser(parser, workers=2) as async_parser:
+            values = []
+            future = async_parser.parse(sent, callback=values.append)
+            _, r = future.get(10)
+            assert future.successful() and values == [future.get()]
+            assert str(expected) == str(r)
+            with pytest.raises(ParseException):
+                async_parser.parse("").get(10)
+
+            # tokens of each session are parsed in order
+            utterances = [("blink", "light", "quickly"),
+                          ("turn off", "red", "light", "quickly")] * 3
+            sessions = [async_parser.new_session() for _ in utterances]
+            futures = [[] for _ in utterances]
+            for i in range(4):
+                for session, tokens, fs in zip(sessions, utterances,
+                                               futures):
+                    if i < len(tokens):
+                        fs.append(session.incremental_parse(
+                            tokens[i], i == len(tokens) - 1))
+            for tokens, fs in zip(utterances, futures):
+                assert all(f.get(10) == (None, None) for f in fs[:-1])
+                assert tokens[0] == fs[-1].get(10)[1].action
+            sessions[0].clear().get(10)
+            assert sessions[0].session.chart is None
+
+    def test_async_parser_close(self):
+        parser = TestParser.parser
+        async_parser = AsyncParser(parser, workers=1)
+        sessions = [async_parser.new_session() for _ in range(2)]
+        futures = [session.incremental_parse(token, False)
+                   for session in sessions
+                   for token in ("blink", "light") * 6]
+
+        def bad_callback(value):
+            raise RuntimeError("bad callback")
+
+        future = async_parser.parse(TestParser.test_str, bad_callback)
+        async_parser.close()
+        # close() finishes every queued call
+        assert all(f.ready() and f.successful() for f in futures)
+        # a failing callback doesn't replace the value
+        assert future.successful()
+        assert future.get()[1].action == "blink"
+
     def test_num_edges(self):
         class BadRule(ChartRule):
             NUM_EDGES = 2
@@ -559,6 +1211,96 @@ class TestDocGrammar(object):
             print()
 
 
+class TestServer(object):
+    def test_session_store(self):
+        from parsetron.server import SessionStore
+        now = [0.0]
+        store = SessionStore(TestParser.parser, max_sessions=2,
+                             idle_timeout=10, clock=lambda: now[0])
+        store.incremental_parse("a", "blink", False)
+        store.incremental_parse("b", "blink", False)
+        store.incremental_parse("a", "light", False)
+        # least recently used "b" is evicted
+        store.incremental_parse("c", "blink", False)
+        assert "b" not in store and 2 == len(store)
+        _, r = store.incremental_parse("a", "quickly", True)
+        assert "blink" == r.action
+        now[0] = 5.0
+        store.incremental_parse("c", "light", False)
+        # "a" expires, "c" was used 5 seconds ago
+        now[0] = 12.0
+        _, r = store.incremental_parse("c", "quickly", True)
+        assert "a" not in store and 1 == len(store)
+        assert "blink" == r.action
+
+    def test_expired_sessions(self):
+        import json
+        from parsetron.server import SessionStore, handle_request
+        now = [0.0]
+        store = SessionStore(TestParser.parser, max_sessions=2,
+                             idle_timeout=10, clock=lambda: now[0])
+
+        def request(**kwargs):
+            return json.loads(handle_request(store, json.dumps(kwargs)))
+
+        request(session="a", token="blink")
+        request(session="b", token="blink")
+        request(session="c", token="blink")
+        # "a" was evicted: its utterance isn't silently restarted
+        assert {"session": "a", "expired": True} == \
+            request(session="a", token="light")
+        assert "a" not in store
+        now[0] = 20.0
+        # "b" and "c" timed out
+        assert {"session": "c", "expired": True} == \
+            request(session="c", token="light", final=True)
+        assert 0 == len(store)
+        # until the client starts a new utterance
+        request(session="c", token="blink", first=True)
+        request(session="c", token="light")
+        r = request(session="c", token="quickly", final=True)
+        assert "blink" == r["result"]["action"]
+        # new ids still create sessions
+        assert {"session": "d", "result": None} == \
+            request(session="d", token="blink")
+
+    def test_serve(self):
+        import io
+        import json
+        from parsetron.server import SessionStore, serve
+        requests = [
+            {"session": "a", "token": "blink", "id": 1},
+            {"session": "b", "token": "turn off"},
+            {"session": "a", "token": "light"},
+            {"session": "b", "token": "light"},
+            {"session": "a", "token": "quickly", "final": True},
+            {"session": "b", "close": True},
+            {"text": TestParser.test_str},
+            {"token": "no session"},
+        ]
+
+        class Output(list):
+            write = list.append
+
+            def flush(self):
+                pass
+
+        infile = io.StringIO(u"\n".join(json.dumps(r) for r in requests) +
+                             u"\nnot json\n")
+        outfile = Output()
+        store = SessionStore(TestParser.parser)
+        serve(store, infile, outfile)
+        responses = [json.loads(line)
+                     for line in "".join(outfile).splitlines()]
+        assert len(requests) + 1 == len(responses)
+        assert {"session": "a", "id": 1, "result": None} == responses[0]
+        assert "blink" == responses[4]["result"]["action"]
+        assert {"session": "b", "closed": True} == responses[5]
+        assert "b" not in store
+        assert [1] == responses[6]["result"]["times"]
+        assert "error" in responses[7] and "error" in responses[8]
+
+
 def test_find_word_boundaries():
     boundaries, starts, ends = find_word_boundaries(strip_string(
         "my lights are off"))